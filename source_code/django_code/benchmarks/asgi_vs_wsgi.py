@@ -0,0 +1,148 @@
+"""
+Requests/sec and p99 latency of blog pages under WSGI and ASGI.
+
+Each mode runs in its own process against the configured database:
+
+- wsgi: the sync views through the WSGI handler, one thread per
+  concurrent reader, like a threaded WSGI worker.
+- asgi: the async views (BLOG_ASYNC_VIEWS) through the ASGI handler,
+  one task per concurrent reader on a single event loop.
+
+The page cache is disabled so that every request reaches the views.
+
+Usage, from the directory of manage.py:
+
+    python benchmarks/asgi_vs_wsgi.py --concurrency 32 --requests 2000 /blog/
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(mode):
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    os.environ['BLOG_ASYNC_VIEWS'] = str(mode == 'asgi')
+    os.environ['BLOG_PAGE_CACHE_ENABLED'] = 'False'
+    import django
+    from django.conf import settings
+    django.setup()
+    # Host name used by the test clients
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+
+def report(mode, latencies, elapsed, errors):
+    latencies.sort()
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def run_wsgi(paths, concurrency, requests):
+    from django.db import connections
+    from django.test import Client
+
+    latencies = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def reader():
+        client = Client()
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                break
+            start = time.perf_counter()
+            response = client.get(paths[n % len(paths)])
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+        connections.close_all()
+
+    threads = [threading.Thread(target=reader) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return report('wsgi', latencies, time.perf_counter() - start, len(errors))
+
+
+def run_asgi(paths, concurrency, requests):
+    import asyncio
+    from django.test import AsyncClient
+
+    latencies = []
+    errors = []
+
+    async def reader(counter):
+        client = AsyncClient()
+        for n in counter:
+            start = time.perf_counter()
+            response = await client.get(paths[n % len(paths)])
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    async def main():
+        # Readers share one iterator, the event loop runs them one step at a time
+        counter = iter(range(requests))
+        await asyncio.gather(*(reader(counter) for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return report('asgi', latencies, time.perf_counter() - start, len(errors))
+
+
+def child(args):
+    setup(args.mode)
+    run = run_wsgi if args.mode == 'wsgi' else run_asgi
+    # Warm up connections, templates and the sidebar cache
+    run(args.paths, args.concurrency, args.concurrency)
+    print(json.dumps(run(args.paths, args.concurrency, args.requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*', default=['/blog/'])
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--mode', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return child(args)
+
+    print(f'{"mode":<6}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    for mode in ['wsgi', 'asgi']:
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode,
+             '--concurrency', str(args.concurrency),
+             '--requests', str(args.requests), *args.paths],
+            check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f'{mode:<6}{result["requests"]:>10}{result["errors"]:>8}'
+            f'{result["rps"]:>10.1f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
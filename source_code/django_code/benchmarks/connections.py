@@ -0,0 +1,154 @@
+"""
+Connection setup cost of the DB_CONN_STRATEGY settings.
+
+Each strategy runs in its own process against the configured (local)
+PostgreSQL database. A fixed set of worker threads, like the threads of a
+WSGI worker, calls the WSGI handler directly, so the request_started and
+request_finished signals close or keep connections the way they do in
+production. Per strategy it reports requests/sec, p50/p99 latency, the
+number of connections opened (pool checkouts for 'pool') and the time
+spent opening them per request.
+
+The page cache is disabled so that every request reaches the database.
+
+Usage, from the directory of manage.py:
+
+    python benchmarks/connections.py --threads 8 --requests 2000 /blog/
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STRATEGIES = ['none', 'persistent', 'pool']
+
+
+def setup(strategy):
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    os.environ['DB_CONN_STRATEGY'] = strategy
+    os.environ['BLOG_PAGE_CACHE_ENABLED'] = 'False'
+    os.environ['BLOG_METRICS_SAMPLE_RATE'] = '0'
+    import django
+    from django.conf import settings
+    django.setup()
+    # Host name of the requests built below
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+
+def count_connects():
+    # Time every new connection (or pool checkout) of the backend
+    from django.db import connections
+
+    wrapper_class = type(connections['default'])
+    get_new_connection = wrapper_class.get_new_connection
+    stats = {'connects': 0, 'connect_seconds': 0.0}
+    lock = threading.Lock()
+
+    def timed_get_new_connection(self, conn_params):
+        start = time.perf_counter()
+        try:
+            return get_new_connection(self, conn_params)
+        finally:
+            with lock:
+                stats['connects'] += 1
+                stats['connect_seconds'] += time.perf_counter() - start
+
+    wrapper_class.get_new_connection = timed_get_new_connection
+    return stats
+
+
+def request(application, path):
+    environ = {'PATH_INFO': path, 'SERVER_NAME': 'testserver', 'wsgi.input': io.BytesIO()}
+    setup_testing_defaults(environ)
+    status = []
+    response = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    try:
+        for _ in response:
+            pass
+    finally:
+        # Sends request_finished, which closes connections past their age
+        response.close()
+    return int(status[0].split()[0])
+
+
+def run(application, paths, threads, requests):
+    latencies = []
+    errors = []
+
+    def one(n):
+        start = time.perf_counter()
+        status = request(application, paths[n % len(paths)])
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def child(args):
+    setup(args.strategy)
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    # Warm up templates and the sidebar cache
+    run(application, args.paths, args.threads, args.threads)
+    stats = count_connects()
+    result = run(application, args.paths, args.threads, args.requests)
+    result['connects'] = stats['connects']
+    result['connect_ms_per_request'] = stats['connect_seconds'] * 1000 / args.requests
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*', default=['/blog/'])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--strategy', choices=STRATEGIES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.strategy:
+        return child(args)
+
+    print(
+        f'{"strategy":<12}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}'
+        f'{"p99 ms":>10}{"connects":>10}{"connect ms/req":>16}'
+    )
+    for strategy in STRATEGIES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--strategy', strategy,
+             '--threads', str(args.threads),
+             '--requests', str(args.requests), *args.paths],
+            check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f'{strategy:<12}{result["requests"]:>10}{result["errors"]:>8}'
+            f'{result["rps"]:>10.1f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}'
+            f'{result["connects"]:>10}{result["connect_ms_per_request"]:>16.3f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
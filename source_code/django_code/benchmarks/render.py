@@ -0,0 +1,117 @@
+"""
+Render time of the post list page.
+
+Renders blog/post/list.html (with base.html and the sidebar) for the
+first page of published posts of the configured database, the way the
+post_list view does, and reports the mean and p99 time per page of:
+
+  uncached     templates read and compiled on every render, a reverse()
+               per post URL, no fragment cache (the previous setup)
+  loader       cached template loader
+  urls         cached loader and memoized Post.get_absolute_url
+  fragments    all of the above and warm {% cache %} fragments
+
+The sidebar is cached, as it is between content changes, and the posts
+are fetched once, so only rendering is measured.
+
+Usage, from the directory of manage.py:
+
+    python benchmarks/render.py --renders 500 --per-page 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VARIANTS = ['uncached', 'loader', 'urls', 'fragments']
+
+LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+def setup():
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    import django
+    django.setup()
+
+
+def template_backend(cached):
+    from django.conf import settings
+    from django.template.backends.django import DjangoTemplates
+
+    params = {**settings.TEMPLATES[0], 'NAME': 'render-benchmark', 'APP_DIRS': False}
+    del params['BACKEND']
+    loaders = [('django.template.loaders.cached.Loader', LOADERS)] if cached else LOADERS
+    params['OPTIONS'] = {**params['OPTIONS'], 'loaders': loaders}
+    return DjangoTemplates(params)
+
+
+def context(per_page):
+    from django.core.paginator import Paginator
+
+    from blog.models import Post
+
+    posts = Post.published.for_listing().prefetch_related('tags')
+    page = Paginator(posts, per_page).page(1)
+    # Fetch the posts and their tags once
+    page.object_list = list(page.object_list)
+    return {'posts': page, 'tag': None, 'pagination_template': 'pagination.html'}
+
+
+def run(variant, renders, per_page):
+    from django.core.cache import caches
+    from django.test import RequestFactory, override_settings
+
+    from blog import models
+
+    fragments = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+        if variant == 'fragments' else 'django.core.cache.backends.dummy.DummyCache',
+        'LOCATION': 'render-benchmark',
+    }
+    post_url = models.post_url
+    if variant in ('uncached', 'loader'):
+        # A reverse() per call, as before
+        models.post_url = post_url.__wrapped__
+    backend = template_backend(cached=variant != 'uncached')
+    request = RequestFactory().get('/blog/')
+    data = context(per_page)
+    times = []
+    try:
+        with override_settings(CACHES={**caches.settings, 'template_fragments': fragments}):
+            # Warm up the sidebar and fragment caches
+            backend.get_template('blog/post/list.html').render(data, request)
+            for _ in range(renders):
+                start = time.perf_counter()
+                backend.get_template('blog/post/list.html').render(data, request)
+                times.append(time.perf_counter() - start)
+    finally:
+        models.post_url = post_url
+    times.sort()
+    return {
+        'mean_ms': statistics.mean(times) * 1000,
+        'p99_ms': times[int(len(times) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--renders', type=int, default=500)
+    parser.add_argument('--per-page', type=int, default=3)
+    args = parser.parse_args()
+
+    setup()
+    print(f'{"variant":<12}{"mean ms":>10}{"p99 ms":>10}')
+    for variant in VARIANTS:
+        result = run(variant, args.renders, args.per_page)
+        print(f'{variant:<12}{result["mean_ms"]:>10.3f}{result["p99_ms"]:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+Benchmark suite for the blog views.
+
+Drives the post list, post detail, search, feed and sitemap pages at fixed
+concurrency through the Django test client and through a local HTTP server
+(wsgiref, one thread per connection), and records per scenario:
+
+- p50/p95/p99 latency and requests/sec for both drivers,
+- queries per request and allocated memory per request (tracemalloc),
+  measured in a separate sequential pass through the test client.
+
+The results are written as a JSON report. Given a baseline report, the
+run fails when a scenario got slower or needs more queries or memory than
+the baseline allows.
+
+Seed a corpus first, from the directory of manage.py:
+
+    python manage.py seed_blog --posts 5000 --comments 25000
+    python benchmarks/run.py --output report.json
+    python benchmarks/run.py --baseline report.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(page_cache):
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    os.environ.setdefault('DEBUG', 'False')
+    os.environ['BLOG_PAGE_CACHE_ENABLED'] = str(page_cache)
+    import django
+    from django.conf import settings
+    django.setup()
+    # Host names used by the test client and the local server
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver', '127.0.0.1']
+
+
+def scenarios(seed):
+    # URLs of every scenario, drawn from the seeded corpus
+    from django.urls import reverse
+    from taggit.models import Tag
+    from blog.corpus import search_terms
+    from blog.models import Post
+
+    rng = random.Random(seed)
+    post_count = Post.published.count()
+    if not post_count:
+        raise SystemExit('No published posts, run `manage.py seed_blog` first.')
+    # Sampled with the seed, so every run requests the same posts
+    post_ids = list(Post.published.order_by('pk').values_list('pk', flat=True))
+    sample = rng.sample(post_ids, min(200, len(post_ids)))
+    posts = Post.published.for_links().in_bulk(sample)
+    posts = [posts[pk] for pk in sample]
+    tag_slugs = list(
+        Tag.objects.filter(post__isnull=False).distinct()
+        .order_by('slug').values_list('slug', flat=True)[:50]
+    )
+    terms = search_terms(20)
+    pages = max(1, post_count // 3)
+    return {
+        'post_list': [
+            reverse('blog:post_list') + f'?page={rng.randint(1, pages)}'
+            for _ in range(50)
+        ],
+        'post_list_by_tag': [
+            reverse('blog:post_list_by_tag', args=[slug]) for slug in tag_slugs
+        ],
+        'post_detail': [post.get_absolute_url() for post in posts],
+        'post_search': [
+            reverse('blog:post_search') + f'?query={term}' for term in terms
+        ],
+        'feed': [reverse('blog:post_feed'), reverse('blog:post_feed_atom')],
+        'sitemap': [
+            reverse('blog:django.contrib.sitemaps.views.sitemap'),
+            reverse('blog:sitemap_section', kwargs={'section': 'posts', 'page': 1}),
+        ],
+    }
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def drive(fetch, urls, concurrency, requests):
+    # Run `requests` fetches over `concurrency` threads, `fetch` returns
+    # the status code of a URL
+    local = threading.local()
+    latencies = []
+    errors = []
+
+    def one(n):
+        start = time.perf_counter()
+        status = fetch(local, urls[n % len(urls)])
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    return summarize(latencies, time.perf_counter() - start, len(errors))
+
+
+def client_fetch(local, url):
+    from django.test import Client
+    if not hasattr(local, 'client'):
+        local.client = Client()
+    return local.client.get(url).status_code
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def http_fetch(base_url):
+    def fetch(local, url):
+        try:
+            with urllib.request.urlopen(base_url + url) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return fetch
+
+
+def profile(urls, requests):
+    # Queries and allocations per request, one request at a time
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    client = Client()
+    queries = []
+    allocations = []
+    tracemalloc.start()
+    try:
+        for n in range(requests):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            with CaptureQueriesContext(connection) as captured:
+                client.get(urls[n % len(urls)])
+            allocations.append(tracemalloc.get_traced_memory()[1] - before)
+            queries.append(len(captured))
+    finally:
+        tracemalloc.stop()
+    return {
+        'queries_avg': round(statistics.mean(queries), 2),
+        'queries_max': max(queries),
+        'alloc_peak_kib': round(statistics.mean(allocations) / 1024, 1),
+    }
+
+
+def compare(report, baseline, tolerance):
+    # Regressions of the report against the baseline, as messages
+    regressions = []
+    for name, result in report['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        for driver in ('client', 'http'):
+            if driver in result and driver in base:
+                for metric in ('p95_ms', 'p99_ms'):
+                    if result[driver][metric] > base[driver][metric] * (1 + tolerance):
+                        regressions.append(
+                            f'{name} {driver} {metric}: '
+                            f'{base[driver][metric]} -> {result[driver][metric]}'
+                        )
+        if result['queries_max'] > base['queries_max']:
+            regressions.append(
+                f'{name} queries_max: {base["queries_max"]} -> {result["queries_max"]}'
+            )
+        if result['alloc_peak_kib'] > base['alloc_peak_kib'] * (1 + tolerance):
+            regressions.append(
+                f'{name} alloc_peak_kib: {base["alloc_peak_kib"]} -> {result["alloc_peak_kib"]}'
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and driver.')
+    parser.add_argument('--profile-requests', type=int, default=20)
+    parser.add_argument('--scenario', action='append', help='Only run these scenarios.')
+    parser.add_argument('--no-http', action='store_true', help='Skip the local HTTP server driver.')
+    parser.add_argument('--page-cache', action='store_true', help='Keep the page cache enabled.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the URL sampling.')
+    parser.add_argument('--output', help='File to write the JSON report to.')
+    parser.add_argument('--baseline', help='Report to compare against.')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.2,
+        help='Allowed relative increase of latency and allocations over the baseline.'
+    )
+    args = parser.parse_args()
+
+    setup(args.page_cache)
+    import django
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connection
+    from blog.models import Comment, Post
+
+    urls = scenarios(args.seed)
+    if args.scenario:
+        urls = {name: urls[name] for name in args.scenario}
+
+    server = None
+    if not args.no_http:
+        server = make_server(
+            '127.0.0.1', 0, get_wsgi_application(),
+            server_class=ThreadingWSGIServer, handler_class=QuietHandler
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'posts': Post.objects.count(),
+            'comments': Comment.objects.count(),
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'page_cache': args.page_cache,
+        },
+        'scenarios': {},
+    }
+    try:
+        for name, scenario_urls in urls.items():
+            # Warm up templates, connections and caches
+            drive(client_fetch, scenario_urls, args.concurrency, args.concurrency)
+            result = {'client': drive(client_fetch, scenario_urls, args.concurrency, args.requests)}
+            if server:
+                result['http'] = drive(http_fetch(base_url), scenario_urls, args.concurrency, args.requests)
+            result.update(profile(scenario_urls, args.profile_requests))
+            report['scenarios'][name] = result
+            print(
+                f'{name:<18} client p50 {result["client"]["p50_ms"]:>8} ms  '
+                f'p99 {result["client"]["p99_ms"]:>8} ms  '
+                f'{result["queries_max"]:>3} queries  {result["alloc_peak_kib"]:>8} KiB'
+            )
+    finally:
+        if server:
+            server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(report, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions against the baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,12 @@ from django.apps import AppConfig
 
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'blog'
\ No newline at end of file
+    name = 'blog'
+
+    def ready(self):
+        # Connect the cache invalidation signal receivers
+        from . import signals  # noqa: F401
+        # Time queries and template rendering of the requests sampled for metrics
+        from .metrics import instrument_queries, instrument_templates
+        instrument_queries()
+        instrument_templates()
@@ -0,0 +1,285 @@
+# Bulk import and export of posts, with their tags and comments, as JSON
+# lines: one post per line, so both directions stream in constant memory
+import json
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+
+from .cache import invalidate_sidebar
+from .models import Comment, ContentChange, Post, publish_day_lookup, search_document
+from .pagecache import get_cache
+from .rendering import render_post
+
+# Slug collisions on the same publish date (Post.slug is unique_for_date)
+ON_CONFLICT = ['rename', 'skip']
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _datetime(value):
+    if not value:
+        return None
+    value = parse_datetime(value)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+# Export
+
+def _chunked(posts, batch_size):
+    # Posts ordered by pk, through a server-side cursor unless the database
+    # disables them; iterator() would then fetch every row at once, so
+    # batches are read by keyset on the primary key instead
+    if not connections[posts.db].settings_dict['DISABLE_SERVER_SIDE_CURSORS']:
+        yield from posts.iterator(chunk_size=batch_size)
+        return
+    last_pk = None
+    while True:
+        batch = posts if last_pk is None else posts.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        yield from batch
+        last_pk = batch[-1].pk
+
+
+def export_records(batch_size=1000):
+    # Tags and comments are prefetched per chunk of `batch_size` posts
+    posts = (
+        Post.objects.order_by('pk')
+        .select_related('author')
+        .only(
+            'pk', 'title', 'slug', 'body', 'publish', 'created', 'updated',
+            'status', 'author__username'
+        )
+        .prefetch_related(
+            'tags',
+            Prefetch('comments', Comment.objects.order_by('created', 'pk'))
+        )
+    )
+    for post in _chunked(posts, batch_size):
+        yield {
+            'title': post.title,
+            'slug': post.slug,
+            'author': post.author.username,
+            'body': post.body,
+            'publish': _isoformat(post.publish),
+            'created': _isoformat(post.created),
+            'updated': _isoformat(post.updated),
+            'status': post.status,
+            'tags': [tag.name for tag in post.tags.all()],
+            'comments': [
+                {
+                    'name': comment.name,
+                    'email': comment.email,
+                    'body': comment.body,
+                    'created': _isoformat(comment.created),
+                    'updated': _isoformat(comment.updated),
+                    'active': comment.active,
+                }
+                for comment in post.comments.all()
+            ],
+        }
+
+
+# Import
+
+def read_records(lines, start=0):
+    # Parse the lines of a JSONL file lazily, skipping the first `start`
+    for number, line in enumerate(islice(lines, start, None), start + 1):
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f'Line {number}: {e}')
+        else:
+            yield None
+
+
+def batches(records, batch_size):
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        yield batch
+
+
+@contextmanager
+def preserved_timestamps():
+    # bulk_create() fills auto_now and auto_now_add fields with the
+    # current time, imported rows keep the timestamps of the archive
+    fields = [
+        field
+        for model in (Post, Comment)
+        for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Importer:
+    # Imports batches of post records. Authors and tags are resolved to
+    # IDs with one query per batch and remembered across batches.
+
+    def __init__(self, on_conflict='rename'):
+        self.on_conflict = on_conflict
+        self.author_ids = {}
+        self.tag_ids = {}
+        self.content_type = ContentType.objects.get_for_model(Post)
+
+    def resolve_authors(self, usernames):
+        User = get_user_model()
+        missing = set(usernames) - self.author_ids.keys()
+        if not missing:
+            return
+        found = dict(
+            User.objects.filter(username__in=missing).values_list('username', 'pk')
+        )
+        new_users = []
+        for username in missing - found.keys():
+            user = User(username=username)
+            user.set_unusable_password()
+            new_users.append(user)
+        User.objects.bulk_create(new_users, ignore_conflicts=True)
+        if new_users:
+            found = dict(
+                User.objects.filter(username__in=missing).values_list('username', 'pk')
+            )
+        self.author_ids.update(found)
+
+    def resolve_tags(self, names):
+        missing = set(names) - self.tag_ids.keys()
+        if not missing:
+            return
+        self.tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'pk'))
+        missing -= self.tag_ids.keys()
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=slugify(name)) for name in missing],
+            ignore_conflicts=True
+        )
+        self.tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'pk'))
+        # Names whose slug is taken by another tag get a unique slug from taggit
+        for name in missing - self.tag_ids.keys():
+            self.tag_ids[name] = Tag.objects.create(name=name).pk
+
+    def taken_slugs(self, posts):
+        # (slug, publish date) pairs of stored posts using the slugs of a batch
+        slugs = {post.slug for post in posts}
+        stored = Post.objects.filter(slug__in=slugs).values_list('slug', 'publish')
+        return {(slug, timezone.localdate(publish)) for slug, publish in stored}
+
+    def unique_slug(self, post, taken):
+        day = timezone.localdate(post.publish)
+        if (post.slug, day) not in taken:
+            return post.slug
+        if self.on_conflict == 'skip':
+            return None
+        stored = set(
+            Post.objects.filter(
+                slug__startswith=f'{post.slug}-',
+                **publish_day_lookup(day.year, day.month, day.day)
+            ).values_list('slug', flat=True)
+        )
+        suffix = 2
+        while (
+            (slug := f'{post.slug}-{suffix}') in stored
+            or (slug, day) in taken
+        ):
+            suffix += 1
+        return slug
+
+    def build_post(self, record):
+        now = timezone.now()
+        post = Post(
+            title=record['title'],
+            slug=record.get('slug') or slugify(record['title']),
+            author_id=self.author_ids[record['author']],
+            body=record['body'],
+            publish=_datetime(record.get('publish')) or now,
+            created=_datetime(record.get('created')) or now,
+            updated=_datetime(record.get('updated')) or now,
+            status=record.get('status', Post.Status.DRAFT),
+        )
+        render_post(post)
+        post.active_comment_count = sum(
+            1 for comment in record.get('comments', ()) if comment.get('active', True)
+        )
+        return post
+
+    def build_comment(self, post, record):
+        created = _datetime(record.get('created')) or post.created
+        return Comment(
+            post=post,
+            name=record['name'],
+            email=record['email'],
+            body=record['body'],
+            created=created,
+            updated=_datetime(record.get('updated')) or created,
+            active=record.get('active', True),
+        )
+
+    def import_batch(self, records):
+        # Returns the number of posts, comments and tag links created
+        # and of records skipped
+        records = [record for record in records if record]
+        self.resolve_authors({record['author'] for record in records})
+        self.resolve_tags({name for record in records for name in record.get('tags', ())})
+
+        posts = []
+        kept = []
+        candidates = [self.build_post(record) for record in records]
+        taken = self.taken_slugs(candidates)
+        for post, record in zip(candidates, records):
+            post.slug = self.unique_slug(post, taken)
+            if post.slug is None:
+                continue
+            taken.add((post.slug, timezone.localdate(post.publish)))
+            posts.append(post)
+            kept.append(record)
+
+        with transaction.atomic(), preserved_timestamps():
+            Post.objects.bulk_create(posts)
+            Post.objects.filter(pk__in=[post.pk for post in posts]).update(
+                search_vector=search_document()
+            )
+            comments = Comment.objects.bulk_create([
+                self.build_comment(post, comment)
+                for post, record in zip(posts, kept)
+                for comment in record.get('comments', ())
+            ])
+            tagged_items = TaggedItem.objects.bulk_create([
+                TaggedItem(
+                    content_type=self.content_type,
+                    object_id=post.pk,
+                    tag_id=self.tag_ids[name]
+                )
+                for post, record in zip(posts, kept)
+                for name in set(record.get('tags', ()))
+            ])
+        return len(posts), len(comments), len(tagged_items), len(records) - len(posts)
+
+
+def rebuild_derived_data(stdout=None):
+    # bulk_create() sends no signals, refresh the data they maintain
+    call_command('rebuild_similar_posts', stdout=stdout)
+    call_command('build_feeds', stdout=stdout)
+    invalidate_sidebar()
+    get_cache().clear()
+    # Imported rows keep older `updated` times, move the validators
+    ContentChange.record(ContentChange.Kind.IMPORTED)
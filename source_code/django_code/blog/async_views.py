@@ -0,0 +1,189 @@
+# Async versions of the read-only blog views, used when BLOG_ASYNC_VIEWS
+# is set (the default under project/asgi.py). Queries go through the async
+# ORM API and independent queries of a page are awaited together.
+import asyncio
+
+from asgiref.sync import sync_to_async
+from taggit.models import Tag
+from django.conf import settings
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.shortcuts import render, aget_object_or_404
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from django.http import Http404
+
+from .cache import aget_sidebar
+from .comments import PAGE_PARAM as COMMENTS_PAGE_PARAM, comment_page, comment_thread
+from .feeds import LATEST, ensure_feed, feed_path, feed_response
+from .forms import CommentForm, SearchForm
+from .models import POST_LINK_FIELDS, Post, publish_day_lookup
+from .pagination import CursorPaginator, InvalidCursor
+from .templatetags.blog_tags import latest_posts, most_commented_posts
+
+# Sidebar sizes used by base.html
+SIDEBAR_LATEST_POSTS = 3
+SIDEBAR_MOST_COMMENTED_POSTS = 5
+
+
+async def aload_sidebar():
+    # Fill the sidebar cache ahead of rendering, so the template tags
+    # of base.html find their values without querying
+    async def total():
+        return await Post.published.acount()
+
+    async def latest():
+        return [post async for post in latest_posts(SIDEBAR_LATEST_POSTS)]
+
+    async def most_commented():
+        return [post async for post in most_commented_posts(SIDEBAR_MOST_COMMENTED_POSTS)]
+
+    await asyncio.gather(
+        aget_sidebar('total_posts', total),
+        aget_sidebar('latest_posts', latest, SIDEBAR_LATEST_POSTS),
+        aget_sidebar('most_commented_posts', most_commented, SIDEBAR_MOST_COMMENTED_POSTS),
+    )
+
+
+async def arender(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def _page(post_list, number):
+    paginator = Paginator(post_list, 3)
+    # Count asynchronously, Paginator then reuses the cached value
+    paginator.count = await post_list.acount()
+    try:
+        posts = paginator.page(number)
+    except PageNotAnInteger:
+        posts = paginator.page(1)
+    except EmptyPage:
+        posts = paginator.page(paginator.num_pages)
+    posts.object_list = [post async for post in posts.object_list]
+    return posts
+
+
+async def post_list(request, tag_slug=None):
+    post_list = Post.published.for_listing().prefetch_related('tags')
+    tag = None
+
+    if tag_slug:
+        tag, _ = await asyncio.gather(
+            aget_object_or_404(Tag, slug=tag_slug),
+            aload_sidebar()
+        )
+        post_list = post_list.filter(tags__in=[tag])
+    else:
+        await aload_sidebar()
+
+    if settings.BLOG_PAGINATION == 'cursor':
+        paginator = CursorPaginator(post_list, 3)
+        try:
+            posts = await paginator.apage(request.GET.get('cursor'))
+        except InvalidCursor:
+            posts = await paginator.apage()
+        pagination_template = 'cursor_pagination.html'
+    else:
+        posts = await _page(post_list, request.GET.get('page', 1))
+        pagination_template = 'pagination.html'
+
+    return await arender(
+        request,
+        'blog/post/list.html',
+        {
+            'posts': posts,
+            'tag': tag,
+            'pagination_template': pagination_template
+        }
+    )
+
+
+async def post_detail(request, year, month, day, post):
+    try:
+        lookup = publish_day_lookup(year, month, day)
+    except ValueError:
+        raise Http404('No such date')
+    post, _ = await asyncio.gather(
+        aget_object_or_404(
+            Post.objects.select_related('author'),
+            status=Post.Status.PUBLISHED,
+            slug=post,
+            **lookup
+        ),
+        aload_sidebar()
+    )
+
+    # Comments and similar posts only depend on the post
+    page = comment_page(post, request.GET.get(COMMENTS_PAGE_PARAM, 1))
+
+    async def comments():
+        return await sync_to_async(comment_thread)(post, page)
+
+    async def similar_posts():
+        return [
+            entry.similar_post
+            # The entries keep their post, or it is fetched again for every entry
+            async for entry in post.similar_entries.select_related('similar_post').only(
+                'post', *[f'similar_post__{field}' for field in POST_LINK_FIELDS]
+            )
+        ]
+
+    comments, similar_posts = await asyncio.gather(comments(), similar_posts())
+
+    return await arender(
+        request,
+        'blog/post/detail.html',
+        {
+            'post': post,
+            'comments': comments,
+            'comment_page': page,
+            'form': CommentForm(),
+            'similar_posts': similar_posts
+        }
+    )
+
+
+async def post_search(request):
+    form = SearchForm()
+    query = None
+    results = []
+
+    if 'query' in request.GET:
+        form = SearchForm(request.GET)
+        if form.is_valid():
+            query = form.cleaned_data['query']
+            posts = Post.published.for_listing()
+            limit = settings.BLOG_SEARCH_LIMIT
+
+            search_query = SearchQuery(
+                query,
+                config=settings.BLOG_SEARCH_CONFIG,
+                search_type='websearch'
+            )
+            results = [
+                post async for post in
+                posts.filter(search_vector=search_query)
+                .annotate(rank=SearchRank(F('search_vector'), search_query))
+                .order_by('-rank', '-publish')[:limit]
+            ]
+
+            if not results:
+                # SET LOCAL needs a transaction, which async queries cannot open
+                results = await sync_to_async(posts.title_matches)(query, limit)
+
+    return await arender(
+        request,
+        'blog/post/search.html',
+        {
+            'form': form,
+            'query': query,
+            'results': results
+        },
+    )
+
+
+async def post_feed(request, kind='rss', tag_slug=LATEST):
+    path = feed_path(kind, tag_slug)
+    if not path.exists():
+        # Only a feed never written yet needs the database
+        path = await sync_to_async(ensure_feed)(kind, tag_slug)
+    return feed_response(request, path, kind)
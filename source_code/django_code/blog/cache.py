@@ -0,0 +1,81 @@
+# Cache helpers for the blog application
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+SIDEBAR_VERSION_KEY = 'blog:sidebar:version'
+
+
+def sidebar_key(name, *args):
+    # Every sidebar key embeds the current version, so bumping the
+    # version invalidates all of them at once
+    version = cache.get(SIDEBAR_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(SIDEBAR_VERSION_KEY, version, None)
+        version = cache.get(SIDEBAR_VERSION_KEY, version)
+    return ':'.join(['blog:sidebar', str(version), name, *map(str, args)])
+
+
+def get_sidebar(name, default, *args):
+    # Return a cached sidebar value, computing it with `default` on a miss
+    return cache.get_or_set(
+        sidebar_key(name, *args),
+        default,
+        settings.BLOG_SIDEBAR_CACHE_TIMEOUT
+    )
+
+
+async def asidebar_key(name, *args):
+    version = await cache.aget(SIDEBAR_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        await cache.aadd(SIDEBAR_VERSION_KEY, version, None)
+        version = await cache.aget(SIDEBAR_VERSION_KEY, version)
+    return ':'.join(['blog:sidebar', str(version), name, *map(str, args)])
+
+
+async def aget_sidebar(name, default, *args):
+    # Same as get_sidebar, with `default` a coroutine function
+    key = await asidebar_key(name, *args)
+    value = await cache.aget(key)
+    if value is None:
+        value = await default()
+        await cache.aset(key, value, settings.BLOG_SIDEBAR_CACHE_TIMEOUT)
+    return value
+
+
+def invalidate_sidebar():
+    cache.set(SIDEBAR_VERSION_KEY, time.time_ns(), None)
+
+
+# Rendered comment threads, versioned per post so that a change to one
+# comment drops every cached page of its thread
+
+def _comments_version_key(post_id):
+    return f'blog:comments:version:{post_id}'
+
+
+def comments_key(post_id, page):
+    version_key = _comments_version_key(post_id)
+    version = cache.get(version_key)
+    if version is None:
+        version = time.time_ns()
+        cache.add(version_key, version, None)
+        version = cache.get(version_key, version)
+    return f'blog:comments:{post_id}:{version}:{page}'
+
+
+def get_comments(post_id, page, default):
+    # Return the cached HTML of a thread page, rendering it with `default` on a miss
+    return cache.get_or_set(
+        comments_key(post_id, page),
+        default,
+        settings.BLOG_COMMENTS_CACHE_TIMEOUT
+    )
+
+
+def invalidate_comments(post_ids):
+    version = time.time_ns()
+    cache.set_many({_comments_version_key(post_id): version for post_id in post_ids}, None)
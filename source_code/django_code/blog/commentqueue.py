@@ -0,0 +1,123 @@
+# Write-behind comments (BLOG_COMMENT_WRITE_BEHIND). Validated comments
+# are queued in memory and a flusher thread inserts them in batches, every
+# BLOG_COMMENT_FLUSH_INTERVAL seconds or as soon as BLOG_COMMENT_BATCH_SIZE
+# are waiting. bulk_create sends no signals, so the flush updates the
+# comment counters, caches and pages the receivers of blog.signals would.
+#
+# Durability: the queue is flushed at exit, and at most
+# BLOG_COMMENT_QUEUE_MAX comments are ever waiting, a request finding the
+# queue full flushes it itself. A crash loses at most that many comments.
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.urls import reverse
+
+from .cache import invalidate_comments, invalidate_sidebar
+from .models import Comment
+from .pagecache import purge_paths
+from .signals import adjust_comment_count
+
+logger = logging.getLogger(__name__)
+
+_queue = []
+_lock = threading.Lock()
+# Serializes flushes, taken before _lock
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_pid = None
+
+
+def pending():
+    return len(_queue)
+
+
+def _flusher():
+    while True:
+        _wakeup.wait(settings.BLOG_COMMENT_FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Flushing queued comments failed')
+        finally:
+            connection.close()
+
+
+def _start():
+    # Started lazily, and again in a forked worker, which inherits
+    # the queue of its parent but not the flusher thread
+    global _pid
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _queue.clear()
+        _pid = os.getpid()
+    threading.Thread(target=_flusher, name='blog-comment-flusher', daemon=True).start()
+
+
+def enqueue(comment):
+    # Queue a validated, unsaved comment with its post set
+    if _pid != os.getpid():
+        _start()
+    with _lock:
+        _queue.append(comment)
+        size = len(_queue)
+    if size >= settings.BLOG_COMMENT_QUEUE_MAX:
+        # Never let more comments than the cap wait in memory
+        flush()
+    elif size >= settings.BLOG_COMMENT_BATCH_SIZE:
+        _wakeup.set()
+
+
+def _save_each(comments):
+    # After a failed batch, save the comments one by one, losing only
+    # the failing ones (e.g. of a post deleted in the meantime)
+    saved = []
+    for comment in comments:
+        comment.pk = None
+        comment._state.adding = True
+        try:
+            with transaction.atomic():
+                Comment.objects.bulk_create([comment])
+                if comment.active:
+                    adjust_comment_count(comment.post_id, 1)
+        except DatabaseError:
+            logger.exception('Dropping queued comment by %s on post %s', comment.name, comment.post_id)
+        else:
+            saved.append(comment)
+    return saved
+
+
+def flush():
+    # Insert every queued comment, return how many were saved
+    with _flush_lock:
+        with _lock:
+            comments = _queue[:]
+            _queue.clear()
+        if not comments:
+            return 0
+        try:
+            with transaction.atomic():
+                Comment.objects.bulk_create(comments, batch_size=settings.BLOG_COMMENT_BATCH_SIZE)
+                counts = Counter(comment.post_id for comment in comments if comment.active)
+                for post_id, count in counts.items():
+                    adjust_comment_count(post_id, count)
+        except DatabaseError:
+            logger.exception('Inserting %d queued comments failed', len(comments))
+            comments = _save_each(comments)
+        if comments:
+            invalidate_sidebar()
+            invalidate_comments({comment.post_id for comment in comments})
+            purge_paths({
+                reverse('blog:post_list'),
+                *(comment.post.get_absolute_url() for comment in comments),
+            })
+        return len(comments)
+
+
+atexit.register(flush)
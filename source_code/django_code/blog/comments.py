@@ -0,0 +1,38 @@
+# Paginated comment threads of the post detail page. Pages are rendered
+# once and cached (see blog.cache), the page count comes from the stored
+# active_comment_count, so a cached page needs no comment query at all.
+from django.conf import settings
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .cache import get_comments
+
+# Query string parameter of the comment page
+PAGE_PARAM = 'comments'
+
+
+def comment_page(post, number):
+    # A page of the active comments of a post, oldest first
+    paginator = Paginator(
+        post.comments.filter(active=True).order_by('created', 'pk'),
+        settings.BLOG_COMMENTS_PER_PAGE
+    )
+    paginator.count = post.active_comment_count
+    try:
+        return paginator.page(number)
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
+
+
+def render_comments(page):
+    return render_to_string(
+        'blog/post/includes/comments.html',
+        {'comments': page.object_list, 'start': page.start_index()}
+    )
+
+
+def comment_thread(post, page):
+    return mark_safe(get_comments(post.pk, page.number, lambda: render_comments(page)))
@@ -0,0 +1,152 @@
+# Validators for conditional GET (ETag / Last-Modified / 304) on blog views
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router
+from django.views.decorators.http import condition
+from taggit.models import Tag, TaggedItem
+
+from .models import Comment, ContentChange, Post, publish_day_lookup
+
+# Latest change to any post or comment, read from the `updated`
+# indexes of both tables and the deletion times in a single round trip
+LATEST_CHANGE_SQL = f'''
+    SELECT GREATEST(
+        (SELECT MAX(updated) FROM {Post._meta.db_table}),
+        (SELECT MAX(updated) FROM {Comment._meta.db_table}),
+        (SELECT MAX(changed) FROM {ContentChange._meta.db_table})
+    )
+'''
+
+# Latest change to any post, deletions and imports included
+LATEST_POST_CHANGE_SQL = f'''
+    SELECT GREATEST(
+        (SELECT MAX(updated) FROM {Post._meta.db_table}),
+        (SELECT MAX(changed) FROM {ContentChange._meta.db_table} WHERE kind IN (%s, %s))
+    )
+'''
+
+
+# Latest change to a published post or its comments, any deletion included
+POST_DETAIL_CHANGE_SQL = f'''
+    SELECT GREATEST(
+        p.updated,
+        (SELECT MAX(updated) FROM {Comment._meta.db_table} WHERE post_id = p.id),
+        (SELECT MAX(changed) FROM {ContentChange._meta.db_table})
+    )
+    FROM {Post._meta.db_table} p
+    WHERE p.status = %s AND p.slug = %s AND p.publish >= %s AND p.publish < %s
+'''
+
+# Latest change to a post of a tag. Posts leaving the tag are
+# not joined anymore, tag removals are recorded instead.
+TAG_CHANGE_SQL = f'''
+    SELECT GREATEST(
+        (
+            SELECT MAX(p.updated) FROM {Post._meta.db_table} p
+            JOIN {TaggedItem._meta.db_table} i
+                ON i.object_id = p.id AND i.content_type_id = %s
+            JOIN {Tag._meta.db_table} t ON t.id = i.tag_id
+            WHERE t.slug = %s
+        ),
+        (SELECT MAX(changed) FROM {ContentChange._meta.db_table} WHERE kind IN (%s, %s, %s))
+    )
+'''
+
+
+def _memoize_on_request(name, compute):
+    # condition() asks for the ETag and Last-Modified separately,
+    # compute the underlying timestamp once per request
+    def get(request, *args, **kwargs):
+        if not hasattr(request, name):
+            setattr(request, name, compute(*args, **kwargs))
+        return getattr(request, name)
+    return get
+
+
+def _latest_change(sql, params=()):
+    # From the database serving the page, so validators match its content
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _latest_content_change(*args, **kwargs):
+    return _latest_change(LATEST_CHANGE_SQL)
+
+
+def _latest_post_change(*args, **kwargs):
+    return _latest_change(
+        LATEST_POST_CHANGE_SQL,
+        [ContentChange.Kind.POST_DELETED, ContentChange.Kind.IMPORTED]
+    )
+
+
+def _latest_detail_change(year, month, day, post):
+    try:
+        lookup = publish_day_lookup(year, month, day)
+    except ValueError:
+        # No validators, the view answers 404
+        return None
+    return _latest_change(
+        POST_DETAIL_CHANGE_SQL,
+        [Post.Status.PUBLISHED, post, lookup['publish__gte'], lookup['publish__lt']]
+    )
+
+
+def _latest_tag_change(tag_slug):
+    return _latest_change(
+        TAG_CHANGE_SQL,
+        [
+            ContentType.objects.get_for_model(Post).id,
+            tag_slug,
+            ContentChange.Kind.POST_DELETED,
+            ContentChange.Kind.IMPORTED,
+            ContentChange.Kind.TAGS_REMOVED,
+        ]
+    )
+
+
+def _etag(latest):
+    # Weak, since pages embed a per-reader CSRF token
+    if latest is not None:
+        return f'W/"{latest.timestamp():.6f}"'
+
+
+def _conditional(name, compute):
+    # Decorator answering conditional GETs from the time `compute`
+    # returns for the view arguments
+    latest_change = _memoize_on_request(name, compute)
+
+    def etag(request, *args, **kwargs):
+        return _etag(latest_change(request, *args, **kwargs))
+
+    def decorator(view):
+        conditional_view = condition(
+            etag_func=etag,
+            last_modified_func=latest_change
+        )(view)
+        if not iscoroutinefunction(view):
+            return conditional_view
+
+        # condition() calls the validators synchronously, so async views
+        # run the validator query first and leave the result on the request
+        @wraps(view)
+        async def async_view(request, *args, **kwargs):
+            await sync_to_async(latest_change)(request, *args, **kwargs)
+            return await conditional_view(request, *args, **kwargs)
+        return async_view
+    return decorator
+
+
+# The post list shows every post, and the sidebar their comment counts
+content_condition = _conditional('_blog_latest_content_change', _latest_content_change)
+# A detail page shows its post and comments, a tag page the posts of the
+# tag. The sidebar of both is left out of their validators, so that a
+# comment elsewhere does not change them.
+post_condition = _conditional('_blog_latest_detail_change', _latest_detail_change)
+tag_condition = _conditional('_blog_latest_tag_change', _latest_tag_change)
+# The sitemap only depends on posts
+posts_condition = _conditional('_blog_latest_post_change', _latest_post_change)
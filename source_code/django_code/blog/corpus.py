@@ -0,0 +1,97 @@
+# Synthetic, reproducible blog corpus for benchmarks. Word, tag and comment
+# frequencies follow Zipf distributions: a few tags label most posts, a few
+# posts get most comments and a few words make most of the text.
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.utils import timezone
+
+from .models import Post
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'shi', 'ben', 'dor', 'gal', 'pex']
+
+
+def zipf_weights(n, s):
+    return list(accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+def vocabulary(size, seed=0):
+    # Distinct pronounceable words, the most frequent first
+    rng = random.Random(seed)
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def search_terms(count, words=5000, seed=0):
+    # Frequent, medium and rare words of the corpus vocabulary
+    vocabulary_words = vocabulary(words, seed)
+    return vocabulary_words[::max(1, words // count)][:count]
+
+
+class Corpus:
+
+    def __init__(self, posts, tags, comments, authors=10, words=5000, s=1.1, seed=0):
+        self.posts = posts
+        self.rng = random.Random(seed)
+        self.words = vocabulary(words, seed)
+        self.word_weights = zipf_weights(words, s)
+        self.tags = [f'tag-{word}' for word in vocabulary(tags, seed + 1)]
+        self.tag_weights = zipf_weights(tags, s)
+        self.authors = [f'author{i}' for i in range(authors)]
+        # Comments per post, popular posts get most of them
+        self.comment_counts = [0] * posts
+        ranks = list(range(posts))
+        self.rng.shuffle(ranks)
+        for rank in self.rng.choices(range(posts), cum_weights=zipf_weights(posts, s), k=comments):
+            self.comment_counts[ranks[rank]] += 1
+
+    def text(self, words):
+        return ' '.join(self.rng.choices(self.words, cum_weights=self.word_weights, k=words))
+
+    def body(self):
+        paragraphs = [
+            self.text(self.rng.randint(40, 120)).capitalize() + '.'
+            for _ in range(self.rng.randint(2, 6))
+        ]
+        paragraphs[0] = f'**{paragraphs[0]}**'
+        return '\n\n'.join(paragraphs)
+
+    def records(self):
+        # Post records in the format of blog.archive, oldest first
+        now = timezone.now()
+        for i in range(self.posts):
+            publish = now - timedelta(minutes=(self.posts - i) * 30)
+            title = self.text(self.rng.randint(3, 8)).capitalize()
+            yield {
+                'title': title,
+                'slug': f'{title.lower().replace(" ", "-")[:200]}-{i}',
+                'author': self.rng.choice(self.authors),
+                'body': self.body(),
+                'publish': publish.isoformat(),
+                'created': publish.isoformat(),
+                'updated': publish.isoformat(),
+                # One post in twenty is a draft
+                'status': Post.Status.DRAFT if self.rng.random() < 0.05 else Post.Status.PUBLISHED,
+                'tags': sorted(set(self.rng.choices(
+                    self.tags,
+                    cum_weights=self.tag_weights,
+                    k=self.rng.randint(1, 5)
+                ))),
+                'comments': [
+                    {
+                        'name': f'Reader {j}',
+                        'email': f'reader{j}@example.com',
+                        'body': self.text(self.rng.randint(5, 40)).capitalize() + '.',
+                        'created': (publish + timedelta(minutes=j + 1)).isoformat(),
+                        'active': self.rng.random() > 0.1,
+                    }
+                    for j in range(self.comment_counts[i])
+                ],
+            }
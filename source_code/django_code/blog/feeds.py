@@ -1,22 +1,197 @@
-import markdown
-from django.contrib.syndication.views import Feed
-from django.template.defaultfilters import truncatewords_html
-from django.urls import reverse_lazy
+# RSS and Atom feeds, pre-generated into static files under BLOG_FEED_ROOT
+# when posts change and served from there without touching the database
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db import connection, transaction
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.http import http_date, quote_etag
+from taggit.models import Tag
+
 from .models import Post
+from .routers import primary
+
+logger = logging.getLogger(__name__)
+
+FEED_TYPES = {
+    'rss': Rss201rev2Feed,
+    'atom': Atom1Feed,
+}
+
+# Number of posts in every feed
+FEED_ITEMS = 5
+
+# The latest posts feed, as opposed to the feed of a tag slug
+LATEST = None
+
+
+def feed_path(kind, tag_slug=LATEST):
+    name = 'latest' if tag_slug is LATEST else f'tag-{tag_slug}'
+    return Path(settings.BLOG_FEED_ROOT) / f'{name}.{kind}.xml'
+
+
+def feed_url(kind, tag_slug=LATEST):
+    name = 'blog:post_feed' if kind == 'rss' else f'blog:post_feed_{kind}'
+    if tag_slug is LATEST:
+        return reverse(name)
+    return reverse(f'{name}_by_tag', args=[tag_slug])
+
+
+def feed_posts(tag=None):
+    posts = Post.published.for_listing().order_by('-publish')
+    if tag is not None:
+        posts = posts.filter(tags__in=[tag])
+    return posts[:FEED_ITEMS]
+
+
+def write_atomic(path, content):
+    # Write to a temporary file next to the feed and rename it over the
+    # old one, readers see either the old or the new feed, never a mix
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def render_feeds(tag=None):
+    # Render the feeds of every type from a single query
+    tag_slug = LATEST if tag is None else tag.slug
+    domain = Site.objects.get_current().domain
+    base_url = f'{settings.BLOG_FEED_PROTOCOL}://{domain}'
+    posts = list(feed_posts(tag))
+    if tag is None:
+        title = 'My blog'
+        link = reverse('blog:post_list')
+        description = 'New posts of my blog.'
+    else:
+        title = f'My blog: posts tagged "{tag.name}"'
+        link = reverse('blog:post_list_by_tag', args=[tag.slug])
+        description = f'New posts of my blog tagged "{tag.name}".'
+
+    feeds = {}
+    for kind, feed_type in FEED_TYPES.items():
+        feed = feed_type(
+            title=title,
+            link=base_url + link,
+            description=description,
+            feed_url=base_url + feed_url(kind, tag_slug),
+            language=settings.LANGUAGE_CODE,
+        )
+        for post in posts:
+            feed.add_item(
+                title=post.title,
+                link=base_url + post.get_absolute_url(),
+                description=post.excerpt_html,
+                pubdate=post.publish,
+                updateddate=post.updated,
+            )
+        feeds[kind] = feed.writeString('utf-8').encode()
+    return feeds
+
+
+def remove_feeds(tag_slug):
+    for kind in FEED_TYPES:
+        feed_path(kind, tag_slug).unlink(missing_ok=True)
+
+
+def build_feeds(tag_slugs=(LATEST,)):
+    # Rebuild the feeds of the given tag slugs, LATEST for the latest posts
+    for tag_slug in tag_slugs:
+        tag = None
+        if tag_slug is not LATEST:
+            tag = Tag.objects.filter(slug=tag_slug).first()
+            if tag is None:
+                remove_feeds(tag_slug)
+                continue
+        for kind, content in render_feeds(tag).items():
+            write_atomic(feed_path(kind, tag_slug), content)
+
+
+# Rebuilds are debounced: changes committed within BLOG_FEED_DEBOUNCE
+# seconds of the first one are written together by a timer thread
+
+_pending = set()
+_timer = None
+_lock = threading.Lock()
+
+
+def _build(tag_slugs):
+    try:
+        build_feeds(tag_slugs)
+    except Exception:
+        # The previous feed files stay in place
+        logger.exception('Building the feeds of %s failed', tag_slugs)
+
+
+def _flush():
+    global _timer
+    with _lock:
+        tag_slugs = set(_pending)
+        _pending.clear()
+        _timer = None
+    try:
+        # Read the changes just committed from the primary
+        with primary():
+            _build(tag_slugs)
+    finally:
+        connection.close()
+
+
+def _schedule(tag_slugs):
+    global _timer
+    if settings.BLOG_FEED_DEBOUNCE <= 0:
+        _build(tag_slugs)
+        return
+    with _lock:
+        _pending.update(tag_slugs)
+        if _timer is None:
+            _timer = threading.Timer(settings.BLOG_FEED_DEBOUNCE, _flush)
+            _timer.daemon = True
+            _timer.start()
+
+
+def schedule_feeds(tag_slugs):
+    # Rebuild the feeds once the current transaction commits
+    tag_slugs = set(tag_slugs)
+    transaction.on_commit(lambda: _schedule(tag_slugs))
+
+
+def ensure_feed(kind, tag_slug=LATEST):
+    # The path of a feed, built on the spot if it was never written
+    path = feed_path(kind, tag_slug)
+    if not path.exists():
+        build_feeds([tag_slug])
+        if not path.exists():
+            raise Http404('No such feed')
+    return path
+
 
-class LatestPostsFeed(Feed):
-    title = 'My blog'
-    link = reverse_lazy('blog:post_list')
-    description = 'New posts of my blog.'
-    
-    def items(self):
-        return Post.published.all()[:5]
-
-    def item_title(self, item):
-        return item.title
-
-    def item_description(self, item):
-        return truncatewords_html(markdown.markdown(item.body), 30)
-    
-    def item_pubdate(self, item):
-        return item.publish
\ No newline at end of file
+def feed_response(request, path, kind):
+    # Serve a feed file with ETag and Last-Modified validators
+    with path.open('rb') as feed:
+        stat = os.fstat(feed.fileno())
+        etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        last_modified = int(stat.st_mtime)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(
+                feed.read(),
+                content_type=FEED_TYPES[kind].content_type
+            )
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(last_modified))
+    return response
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from taggit.models import Tag
+
+from blog.feeds import LATEST, build_feeds
+
+
+class Command(BaseCommand):
+    help = 'Write the RSS and Atom feed files of the latest posts and of every tag.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tag',
+            action='append',
+            dest='tags',
+            help='Only rebuild the feeds of this tag slug, can be repeated.'
+        )
+
+    def handle(self, *args, **options):
+        tag_slugs = options['tags']
+        if not tag_slugs:
+            # The latest posts and every tag of a post
+            tag_slugs = [
+                LATEST,
+                *Tag.objects.filter(post__isnull=False).distinct().values_list('slug', flat=True)
+            ]
+        build_feeds(tag_slugs)
+        self.stdout.write(self.style.SUCCESS(f'Built {len(tag_slugs)} RSS and Atom feed pairs.'))
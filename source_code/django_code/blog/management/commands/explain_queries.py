@@ -0,0 +1,131 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from taggit.models import Tag
+
+from blog.feeds import render_feeds
+from blog.models import Post
+
+# Every cache misses, so the queries behind cached fragments run too
+NO_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    for alias in settings.CACHES
+}
+
+
+def plan_scans(plan):
+    # (node type, relation) of every scan node of an EXPLAIN (FORMAT JSON) plan
+    if 'Relation Name' in plan:
+        yield plan['Node Type'], plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from plan_scans(child)
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN on the queries of every blog view against the current '
+        'database (seed it with `seed_blog` first) and fail if any of them '
+        'scans a table sequentially.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=1000,
+            help='Tables with fewer rows may be scanned sequentially, the '
+                 'planner rightly prefers that for small tables.'
+        )
+
+    def pages(self):
+        # Representative URLs of every read-only view
+        posts = Post.published.order_by('-publish')
+        post = Post.published.order_by('-active_comment_count').first()
+        tag = (
+            Tag.objects.filter(post__isnull=False)
+            .annotate(posts=Count('post')).order_by('-posts').first()
+        )
+        if post is None or tag is None:
+            raise CommandError('No published, tagged posts, run `seed_blog` first.')
+        middle_page = max(1, posts.count() // 6)
+        word = post.title.split()[0]
+        return {
+            'post_list': reverse('blog:post_list'),
+            'post_list_page': reverse('blog:post_list') + f'?page={middle_page}',
+            'post_list_by_tag': reverse('blog:post_list_by_tag', args=[tag.slug]),
+            'post_detail': post.get_absolute_url(),
+            'post_detail_comments': post.get_absolute_url() + '?comments=2',
+            'post_search': reverse('blog:post_search') + f'?query={word}',
+            'sitemap_index': reverse('blog:django.contrib.sitemaps.views.sitemap'),
+            'sitemap_section': reverse(
+                'blog:sitemap_section', kwargs={'section': 'posts', 'page': 1}
+            ),
+        }, tag
+
+    def capture(self):
+        # SQL of the queries run by every view, by view name
+        pages, tag = self.pages()
+        client = Client()
+        captured = {}
+        with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            BLOG_PAGE_CACHE_ENABLED=False,
+            CACHES=NO_CACHES,
+        ):
+            for name, url in pages.items():
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+                captured[name] = queries.captured_queries
+            # Feeds are served from files, explain the queries building them
+            for name, feed_tag in [('feed', None), ('feed_by_tag', tag)]:
+                with CaptureQueriesContext(connection) as queries:
+                    render_feeds(feed_tag)
+                captured[name] = queries.captured_queries
+        return captured
+
+    def table_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname, reltuples FROM pg_class WHERE relkind IN ('r', 'p')"
+            )
+            return dict(cursor.fetchall())
+
+    def handle(self, *args, **options):
+        min_rows = options['min_rows']
+        captured = self.capture()
+        rows = self.table_rows()
+        failures = 0
+        with connection.cursor() as cursor:
+            for name, queries in captured.items():
+                selects = [
+                    query['sql'] for query in queries
+                    if query['sql'].lstrip().upper().startswith(('SELECT', 'WITH'))
+                ]
+                self.stdout.write(f'{name}: {len(selects)} queries')
+                for sql in selects:
+                    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, (str, bytes)):
+                        plan = json.loads(plan)
+                    for node_type, relation in plan_scans(plan[0]['Plan']):
+                        if options['verbosity'] > 1:
+                            self.stdout.write(f'  {node_type} on {relation}')
+                        if node_type != 'Seq Scan':
+                            continue
+                        if min_rows and rows.get(relation, 0) < min_rows:
+                            continue
+                        failures += 1
+                        self.stdout.write(self.style.ERROR(
+                            f'  Seq Scan on {relation} ({max(rows.get(relation, 0), 0):.0f} rows): {sql[:300]}'
+                        ))
+        if failures:
+            raise CommandError(f'{failures} sequential scans of tables with {min_rows}+ rows.')
+        self.stdout.write(self.style.SUCCESS('No sequential scans of large tables.'))
@@ -0,0 +1,49 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.archive import export_records
+
+
+class Command(BaseCommand):
+    help = 'Export posts with their tags and comments as JSON lines, one post per line.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            nargs='?',
+            default='-',
+            help='File to write, standard output by default.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of posts fetched from the server-side cursor at a time.'
+        )
+
+    def handle(self, *args, **options):
+        # Progress goes to stderr when the export itself goes to stdout
+        report = self.stderr if options['output'] == '-' else self.stdout
+        out = (
+            sys.stdout if options['output'] == '-'
+            else open(options['output'], 'w', encoding='utf-8')
+        )
+        start = time.perf_counter()
+        total = 0
+        try:
+            for record in export_records(options['batch_size']):
+                out.write(json.dumps(record, ensure_ascii=False))
+                out.write('\n')
+                total += 1
+                if total % options['batch_size'] == 0:
+                    report.write(f'Exported {total} posts...')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        elapsed = time.perf_counter() - start
+        report.write(self.style.SUCCESS(
+            f'Exported {total} posts in {elapsed:.1f}s ({total / elapsed:.0f} rows/sec).'
+        ))
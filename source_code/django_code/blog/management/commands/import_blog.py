@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.archive import ON_CONFLICT, Importer, batches, read_records, rebuild_derived_data
+
+
+class Command(BaseCommand):
+    help = (
+        'Import posts with their tags and comments from JSON lines, as written '
+        'by export_blog. Interrupted imports resume from their checkpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='JSONL file to import, - for standard input.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts created per transaction.'
+        )
+        parser.add_argument(
+            '--on-conflict',
+            choices=ON_CONFLICT,
+            default='rename',
+            help='What to do with a post whose slug is taken on its publish date.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording the lines imported so far, <input>.checkpoint by default.'
+        )
+        parser.add_argument(
+            '--no-rebuild',
+            action='store_true',
+            help='Skip rebuilding similar posts, feeds and caches after the import.'
+        )
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as checkpoint:
+                return int(checkpoint.read())
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, path, lines):
+        # Replace the checkpoint atomically, it always holds a committed count
+        with open(f'{path}.tmp', 'w') as checkpoint:
+            checkpoint.write(str(lines))
+        os.replace(f'{path}.tmp', path)
+
+    def handle(self, *args, **options):
+        stdin = options['input'] == '-'
+        checkpoint = options['checkpoint'] or (None if stdin else f'{options["input"]}.checkpoint')
+        start_line = self.read_checkpoint(checkpoint) if checkpoint else 0
+        if start_line:
+            self.stdout.write(f'Resuming after line {start_line}.')
+
+        try:
+            lines = sys.stdin if stdin else open(options['input'], encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+
+        importer = Importer(options['on_conflict'])
+        line = start_line
+        posts = comments = tags = skipped = 0
+        start = time.perf_counter()
+        try:
+            for batch in batches(read_records(lines, start_line), options['batch_size']):
+                created = importer.import_batch(batch)
+                posts += created[0]
+                comments += created[1]
+                tags += created[2]
+                skipped += created[3]
+                line += len(batch)
+                if checkpoint:
+                    self.write_checkpoint(checkpoint, line)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'Imported {posts} posts, {comments} comments, {tags} tag links '
+                    f'({(posts + comments + tags) / elapsed:.0f} rows/sec)...'
+                )
+        except (KeyError, TypeError, ValueError) as e:
+            raise CommandError(f'Invalid record after line {line}: {e!r}')
+        finally:
+            if not stdin:
+                lines.close()
+
+        elapsed = time.perf_counter() - start
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        if posts and not options['no_rebuild']:
+            rebuild_derived_data(self.stdout)
+
+        rows = posts + comments + tags
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {posts} posts, {comments} comments and {tags} tag links '
+            f'({skipped} skipped) in {elapsed:.1f}s ({rows / elapsed:.0f} rows/sec).'
+        ))
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.pagecache import is_shared_cache, page_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show the hit and miss counters of the blog page cache.'
+
+    def handle(self, *args, **options):
+        if not is_shared_cache():
+            # The counters of the server processes are out of reach
+            raise CommandError(
+                f'The {settings.BLOG_PAGE_CACHE_ALIAS!r} cache keeps its counters in each '
+                'process. Use BLOG_PAGE_CACHE_BACKEND=file, or read the '
+                'blog_page_cache_* counters of every process from /blog/metrics/.'
+            )
+        stats = page_cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / lookups if lookups else 0
+        self.stdout.write(
+            f"Hits: {stats['hits']}\nMisses: {stats['misses']}\nHit ratio: {ratio:.1%}"
+        )
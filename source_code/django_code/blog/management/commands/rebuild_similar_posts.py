@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.similar import update_similar_posts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the similar posts of every post from tag co-occurrence.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts whose similar posts are computed per statement.'
+        )
+
+    def handle(self, *args, **options):
+        post_ids = list(Post.objects.order_by('pk').values_list('pk', flat=True))
+        update_similar_posts(post_ids, batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt similar posts of {len(post_ids)} posts.')
+        )
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from blog.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = 'Fix posts whose stored active comment count drifted from their comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of drifted posts corrected per update.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        actual = Coalesce(
+            Subquery(
+                Comment.objects.filter(post=OuterRef('pk'), active=True)
+                .order_by()
+                .values('post')
+                .annotate(total=Count('pk'))
+                .values('total')
+            ),
+            0
+        )
+        drifted = list(
+            Post.objects.annotate(actual=actual)
+            .exclude(active_comment_count=F('actual'))
+            .values_list('pk', flat=True)
+        )
+        for start in range(0, len(drifted), batch_size):
+            # Recount in the UPDATE itself so concurrent comments are not lost
+            Post.objects.filter(pk__in=drifted[start:start + batch_size]).update(
+                active_comment_count=actual
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f'Reconciled comment counts of {len(drifted)} posts.')
+        )
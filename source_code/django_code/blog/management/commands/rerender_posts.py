@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.rendering import RENDERER_VERSION, render_post
+
+
+class Command(BaseCommand):
+    help = 'Re-render the stored HTML of posts rendered by an older renderer version.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts rendered and written per batch.'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-render every post, not only the stale ones.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.order_by('pk').only('pk', 'body')
+        if not options['all']:
+            posts = posts.exclude(renderer_version=RENDERER_VERSION)
+
+        total = 0
+        last_pk = 0
+        while True:
+            # Walk the table by primary key so each batch is an indexed range
+            batch = list(posts.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for post in batch:
+                render_post(post)
+            Post.objects.bulk_update(
+                batch,
+                ['body_html', 'excerpt_html', 'renderer_version']
+            )
+            total += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f'Rendered {total} posts...')
+
+        self.stdout.write(self.style.SUCCESS(f'Re-rendered {total} posts.'))
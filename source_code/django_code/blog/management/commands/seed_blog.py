@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.archive import Importer, batches, rebuild_derived_data
+from blog.corpus import Corpus
+
+
+class Command(BaseCommand):
+    help = 'Seed a reproducible synthetic corpus of posts, tags and comments for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--authors', type=int, default=10)
+        parser.add_argument(
+            '--zipf',
+            type=float,
+            default=1.1,
+            help='Exponent of the Zipf distributions of tags, comments and words.'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        corpus = Corpus(
+            posts=options['posts'],
+            tags=options['tags'],
+            comments=options['comments'],
+            authors=options['authors'],
+            s=options['zipf'],
+            seed=options['seed']
+        )
+        importer = Importer(on_conflict='rename')
+        start = time.perf_counter()
+        posts = 0
+        for batch in batches(corpus.records(), options['batch_size']):
+            posts += importer.import_batch(batch)[0]
+            self.stdout.write(f'Seeded {posts} posts...')
+        rebuild_derived_data(self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {posts} posts in {time.perf_counter() - start:.1f}s.'
+        ))
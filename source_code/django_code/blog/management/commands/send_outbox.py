@@ -0,0 +1,50 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from blog.outbox import send_batch
+
+
+class Command(BaseCommand):
+    help = 'Send queued e-mails from the outbox over a single reused connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of e-mails claimed and sent per batch.'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling the outbox instead of exiting once it is drained.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to wait between polls of an empty outbox with --loop.'
+        )
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        total = 0
+        try:
+            while True:
+                # Keep one connection open across the whole batch
+                connection.open()
+                sent, claimed = send_batch(connection, options['batch_size'])
+                total += sent
+                if sent:
+                    self.stdout.write(f'Sent {total} e-mails...')
+                if claimed < options['batch_size']:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+        self.stdout.write(self.style.SUCCESS(f'Sent {total} e-mails.'))
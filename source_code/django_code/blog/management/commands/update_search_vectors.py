@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post, search_document
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored full-text search vector of every post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of posts updated per statement.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pks = Post.objects.order_by('pk').values_list('pk', flat=True)
+
+        total = 0
+        last_pk = 0
+        while True:
+            # Walk the table by primary key so each batch is an indexed range
+            batch = list(pks.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            Post.objects.filter(pk__in=batch).update(search_vector=search_document())
+            total += len(batch)
+            last_pk = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Updated search vectors of {total} posts.'))
@@ -0,0 +1,213 @@
+# Per-request performance metrics: wall time, database queries, template
+# rendering and Markdown rendering of a sample of the requests, aggregated
+# into histograms per view and exposed in the Prometheus text format.
+# Histograms live in process memory, every worker process reports its own.
+# The page cache counters are added, per process as well with the locmem
+# page cache backend.
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from .pagecache import page_cache_stats
+
+# Timings of the sampled request being handled, None when not sampled
+_current = ContextVar('blog_metrics_timings', default=None)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Timings:
+    # Measurements of a single request, in seconds
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.durations = {'db': 0.0, 'template': 0.0, 'markdown': 0.0}
+        self.depth = {}
+
+    @contextmanager
+    def timer(self, name):
+        # Nested timers of the same name (template includes) count once
+        depth = self.depth.get(name, 0)
+        self.depth[name] = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.depth[name] = depth
+            if not depth:
+                self.durations[name] += time.perf_counter() - start
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.durations['db'] += time.perf_counter() - start
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total):
+        # Server-Timing header value, durations in milliseconds
+        return ', '.join([
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={self.durations["db"] * 1000:.1f};desc="{self.queries} queries"',
+            f'template;dur={self.durations["template"] * 1000:.1f}',
+            f'markdown;dur={self.durations["markdown"] * 1000:.1f}',
+        ])
+
+
+def start_request():
+    timings = Timings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def timed(name):
+    # Time a block into the current request, a no-op when not sampled
+    timings = _current.get()
+    if timings is None:
+        return nullcontext()
+    return timings.timer(name)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.execute(execute, sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    # connection_created receiver. The wrapper stays on the connection and
+    # finds the sampled request through the context, which sync_to_async()
+    # carries over to the thread running the queries of async views. It
+    # goes first, so execute_wrapper() blocks keep popping their own.
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, execute_wrapper)
+
+
+def instrument_queries():
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(instrument_connection, dispatch_uid='blog_metrics')
+
+
+def instrument_templates():
+    # Time Template.render() of every sampled request, only the outermost
+    # template counts since included templates render inside it
+    from django.template.base import Template
+
+    render = Template.render
+    if getattr(render, 'blog_metrics', False):
+        return
+
+    def timed_render(self, context):
+        with timed('template'):
+            return render(self, context)
+
+    timed_render.blog_metrics = True
+    Template.render = timed_render
+
+
+class Histogram:
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self.lock:
+            series = self.series.get(view)
+            if series is None:
+                series = self.series[view] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {
+                view: (list(counts), count, total)
+                for view, (counts, count, total) in self.series.items()
+            }
+        for view, (counts, count, total) in sorted(series.items()):
+            label = f'view="{_escape(view)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram(
+    'blog_request_duration_seconds', 'Wall time of sampled requests.', DURATION_BUCKETS
+)
+DB_QUERIES = Histogram(
+    'blog_db_queries', 'Database queries per sampled request.', QUERY_BUCKETS
+)
+DB_DURATION = Histogram(
+    'blog_db_duration_seconds', 'Database time of sampled requests.', DURATION_BUCKETS
+)
+TEMPLATE_DURATION = Histogram(
+    'blog_template_duration_seconds', 'Template rendering time of sampled requests.', DURATION_BUCKETS
+)
+MARKDOWN_DURATION = Histogram(
+    'blog_markdown_duration_seconds', 'Markdown rendering time of sampled requests.', DURATION_BUCKETS
+)
+HISTOGRAMS = [REQUEST_DURATION, DB_QUERIES, DB_DURATION, TEMPLATE_DURATION, MARKDOWN_DURATION]
+
+
+def record(view, timings, total):
+    REQUEST_DURATION.observe(view, total)
+    DB_QUERIES.observe(view, timings.queries)
+    DB_DURATION.observe(view, timings.durations['db'])
+    TEMPLATE_DURATION.observe(view, timings.durations['template'])
+    MARKDOWN_DURATION.observe(view, timings.durations['markdown'])
+
+
+def render_page_cache():
+    lines = []
+    for name, value in page_cache_stats().items():
+        metric = f'blog_page_cache_{name}_total'
+        lines += [
+            f'# HELP {metric} Page cache {name}.',
+            f'# TYPE {metric} counter',
+            f'{metric} {value}',
+        ]
+    return lines
+
+
+def render_metrics():
+    lines = [line for histogram in HISTOGRAMS for line in histogram.render()]
+    return '\n'.join(lines + render_page_cache()) + '\n'
+
+
+def reset_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
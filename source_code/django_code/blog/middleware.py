@@ -0,0 +1,104 @@
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, routers
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class MetricsMiddleware:
+    # Measure a BLOG_METRICS_SAMPLE_RATE fraction of the requests: wall
+    # time, queries, template and Markdown rendering. Sampled responses
+    # get a Server-Timing header and feed the histograms of blog.metrics.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        rate = settings.BLOG_METRICS_SAMPLE_RATE
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    def finish(self, request, response, timings):
+        total = timings.total()
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        metrics.record(view, timings, total)
+        response.headers.setdefault('Server-Timing', timings.server_timing(total))
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        timings, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        timings, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, timings)
+
+
+class ReplicaMiddleware:
+    # Route the reads of a request (see blog.routers). After a POST the
+    # reader gets a cookie keeping their reads on the primary for
+    # BLOG_REPLICA_PIN_SECONDS, so they see their own comment.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def pinned(self, request):
+        return (
+            request.method not in SAFE_METHODS
+            or routers.PIN_COOKIE in request.COOKIES
+            or routers.recent_write()
+        )
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                routers.PIN_COOKIE,
+                '1',
+                max_age=settings.BLOG_REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.BLOG_REPLICAS:
+            return self.get_response(request)
+        with routers.request_routing(self.pinned(request)):
+            response = self.get_response(request)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        if not settings.BLOG_REPLICAS:
+            return await self.get_response(request)
+        with routers.request_routing(self.pinned(request)):
+            response = await self.get_response(request)
+        return self.finish(request, response)
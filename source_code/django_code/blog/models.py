@@ -1,11 +1,88 @@
+from datetime import datetime, timedelta
+from functools import lru_cache
+
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField, TrigramSimilarity
+from django.db import connections, models, transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.timezone import now as Now
-from django.urls import reverse
+from django.urls import get_script_prefix, get_urlconf, reverse
 from taggit.managers import TaggableManager 
 
-class PublishedManager(models.Manager):
+from .rendering import render_post
+
+@lru_cache(maxsize=10000)
+def post_url(urlconf, script_prefix, year, month, day, slug):
+    # Detail page URLs, reversed once per post. The URLconf and script
+    # prefix the result depends on are part of the cache key.
+    return reverse('blog:post_detail', args=[year, month, day, slug], urlconf=urlconf)
+
+
+def search_document():
+    # Title matches rank above body matches
+    config = settings.BLOG_SEARCH_CONFIG
+    return (
+        SearchVector('title', weight='A', config=config)
+        + SearchVector('body', weight='B', config=config)
+    )
+
+
+def publish_day_lookup(year, month, day):
+    # Lookups of the posts published on a day of the current time zone, as
+    # a range on `publish` which, unlike publish__day and friends, can use
+    # an index. Raises ValueError for an invalid date.
+    start = datetime(year, month, day)
+    return {
+        'publish__gte': timezone.make_aware(start),
+        'publish__lt': timezone.make_aware(start + timedelta(days=1)),
+    }
+
+
+# Condition of the partial indexes on published posts
+PUBLISHED = Q(status='PB')
+
+
+# Columns needed to link to a post: its title and URL
+POST_LINK_FIELDS = ['id', 'title', 'slug', 'publish']
+
+
+# Minimum trigram similarity of a title matching a search query
+TRIGRAM_THRESHOLD = 0.1
+
+
+class PostQuerySet(models.QuerySet):
+    # Listings never render the body, they load only the columns they show
+
+    def for_links(self):
+        # Title and URL, for the sidebar and similar posts
+        return self.only(*POST_LINK_FIELDS)
+
+    def for_listing(self):
+        # Title, URL, author, dates and stored excerpt, for the post lists,
+        # search results and feeds. `updated` also keys the cached fragments.
+        return self.select_related('author').only(
+            *POST_LINK_FIELDS, 'updated', 'excerpt_html', 'author__username'
+        )
+
+    def title_matches(self, query, limit):
+        # The `limit` posts with the titles most similar to `query`. The %
+        # operator can use the trigram index but matches from
+        # pg_trgm.similarity_threshold (0.3 by default), which is lowered to
+        # TRIGRAM_THRESHOLD for the transaction.
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(f'SET LOCAL pg_trgm.similarity_threshold = {TRIGRAM_THRESHOLD}')
+            return list(
+                self.filter(title__trigram_similar=query)
+                .annotate(similarity=TrigramSimilarity('title', query))
+                .filter(similarity__gt=TRIGRAM_THRESHOLD)
+                .order_by('-similarity', '-publish')[:limit]
+            )
+
+
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     def get_queryset(self):
         return (
             super().get_queryset().filter(status=Post.Status.PUBLISHED)
@@ -34,6 +111,14 @@ class Post(models.Model):
         )
     body = models.TextField()
 
+    # Rendered contents, computed from `body` on save
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
+    renderer_version = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False
+        )
+
     # Time
     # publish = models.DateTimeField(db_default=Now()) # For DB timezone
     publish = models.DateTimeField(default=timezone.now)
@@ -50,25 +135,103 @@ class Post(models.Model):
     # Tagging
     tags = TaggableManager()
 
+    # Weighted full-text document, refreshed on save
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Number of active comments, maintained by the Comment signal receivers
+    active_comment_count = models.PositiveIntegerField(
+        default=0,
+        editable=False
+        )
+
     class Meta:
         ordering = ['-publish']
         indexes = [
             models.Index(fields=['-publish']),
+            models.Index(fields=['-updated']),
+            # Partial indexes on published posts, the rows read by
+            # Post.published: lists, feeds and sitemap pages (publish, id,
+            # covering the lastmod of the sitemap index), detail pages (slug
+            # and publish range), the sidebar
+            models.Index(
+                fields=['-publish', '-id'],
+                condition=PUBLISHED,
+                include=['updated'],
+                name='blog_post_pub_publish_idx'
+            ),
+            models.Index(
+                fields=['slug', 'publish'],
+                condition=PUBLISHED,
+                name='blog_post_pub_slug_idx'
+            ),
+            models.Index(
+                fields=['-active_comment_count'],
+                condition=PUBLISHED,
+                name='blog_post_pub_comments_idx'
+            ),
+            GinIndex(fields=['search_vector'], name='blog_post_search_idx'),
+            # Needs the pg_trgm extension (migration 0007_trigram_ext)
+            GinIndex(
+                fields=['title'],
+                name='blog_post_title_trgm_idx',
+                opclasses=['gin_trgm_ops']
+            ),
         ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored URL parts to purge the old page on changes
+        if 'slug' in field_names and 'publish' in field_names:
+            instance._loaded_url_parts = (instance.publish, instance.slug)
+        # and the stored sitemap entry to purge the affected sitemap pages
+        if 'status' in field_names and 'publish' in field_names:
+            instance._loaded_sitemap_entry = instance.sitemap_entry()
+        return instance
+
+    def sitemap_entry(self):
+        # Sort key of the post in the sitemap, if it is listed there
+        return (self.publish, self.pk) if self.status == self.Status.PUBLISHED else None
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # Never write back a possibly stale comment counter,
+            # it is only changed through F() expressions. Like Django,
+            # only save the loaded fields of a deferred instance, the
+            # body is then only rendered when it is loaded.
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name != 'active_comment_count'
+                and field.attname not in deferred
+            ]
+        # Render the Markdown body once here instead of on every request
+        if update_fields is None or 'body' in update_fields:
+            render_post(self)
+            if update_fields is not None:
+                update_fields = {
+                    *update_fields, 'body_html', 'excerpt_html', 'renderer_version'
+                }
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        if update_fields is None or {'title', 'body'} & set(update_fields):
+            Post.objects.filter(pk=self.pk).update(search_vector=search_document())
     
     # Returns the canonical URL for a post
     def get_absolute_url(self):
-        return reverse(
-            'blog:post_detail',
-            args=[
-                self.publish.year,
-                self.publish.month,
-                self.publish.day,
-                self.slug
-            ]
+        return post_url(
+            get_urlconf(),
+            get_script_prefix(),
+            self.publish.year,
+            self.publish.month,
+            self.publish.day,
+            self.slug
         )
 
 
@@ -89,7 +252,120 @@ class Comment(models.Model):
         ordering = ['created']
         indexes = [
             models.Index(fields=['created']),
+            # Active comments of a post, oldest first
+            models.Index(fields=['post', 'active', 'created']),
+            models.Index(fields=['-updated']),
         ]
 
     def __str__(self):
-        return f'Comment by {self.name} on {self.post}'
\ No newline at end of file
+        return f'Comment by {self.name} on {self.post}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored state to adjust the post comment counters
+        if 'post_id' in field_names and 'active' in field_names:
+            instance._loaded_counter_state = instance.counter_state()
+        return instance
+
+    def counter_state(self):
+        # The post whose counter includes this comment, if any
+        return self.post_id if self.active else None
+
+    def save(self, *args, **kwargs):
+        # Save the comment and update the counters in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class SimilarPost(models.Model):
+    # Precomputed "similar posts" of a post, ranked by shared tags
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='similar_entries'
+    )
+    similar_post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    shared_tag_count = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['rank']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'rank'],
+                name='blog_similarpost_post_rank_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.similar_post} similar to {self.post}'
+
+
+class ContentChange(models.Model):
+    # Time of the latest change of each kind that leaves no newer
+    # `updated` behind: deleted rows, and imported rows keeping the
+    # timestamps of the archive. The validators of blog.conditional
+    # include these times.
+
+    class Kind(models.TextChoices):
+        POST_DELETED = 'post_deleted', 'Post deleted'
+        COMMENT_DELETED = 'comment_deleted', 'Comment deleted'
+        IMPORTED = 'imported', 'Posts imported'
+        TAGS_REMOVED = 'tags_removed', 'Tags removed'
+
+    kind = models.CharField(max_length=20, choices=Kind, primary_key=True)
+    changed = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.get_kind_display()} at {self.changed}'
+
+    @classmethod
+    def record(cls, kind):
+        changed = timezone.now()
+        if not cls.objects.filter(kind=kind).update(changed=changed):
+            cls.objects.get_or_create(kind=kind, defaults={'changed': changed})
+
+
+class OutboundEmail(models.Model):
+    # Durable outbox drained by the `send_outbox` command
+
+    class Status(models.TextChoices):
+        PENDING = 'PD', 'Pending'
+        SENT = 'ST', 'Sent'
+        DEAD = 'DL', 'Dead letter'
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.EmailField()
+    # Recipient domain, for per-domain rate limits
+    domain = models.CharField(max_length=254)
+    status = models.CharField(
+        max_length=2,
+        choices=Status,
+        default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt']),
+            models.Index(fields=['domain', 'sent']),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to}'
+
+    def save(self, *args, **kwargs):
+        self.domain = self.to.rpartition('@')[2].lower()
+        super().save(*args, **kwargs)
@@ -0,0 +1,99 @@
+# Outbox for e-mails sent by the blog, drained in batches by `send_outbox`
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+
+def queue_mail(subject, message, to, from_email=None):
+    # Store the e-mail, the request does not wait for SMTP
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or '',
+        to=to
+    )
+
+
+def claim_batch(batch_size):
+    # Lease due e-mails to this worker so concurrent workers skip them
+    # and a crashed worker's e-mails become due again after the lease
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.Status.PENDING, next_attempt__lte=now)
+            .order_by('next_attempt')[:batch_size]
+        )
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            next_attempt=now + timedelta(seconds=settings.BLOG_OUTBOX_LEASE)
+        )
+    return batch
+
+
+def sent_per_domain(domains):
+    # E-mails sent to each domain during the current rate limit window
+    since = timezone.now() - timedelta(seconds=60)
+    return dict(
+        OutboundEmail.objects.filter(domain__in=domains, sent__gte=since)
+        .values_list('domain')
+        .annotate(total=Count('pk'))
+    )
+
+
+def backoff(attempts):
+    # Exponential backoff between retries, capped at one day
+    return timedelta(seconds=min(settings.BLOG_OUTBOX_BACKOFF * 2 ** (attempts - 1), 86400))
+
+
+def send_batch(connection, batch_size):
+    # Send one batch over an open connection, return how many were sent
+    batch = claim_batch(batch_size)
+    sent_counts = sent_per_domain({email.domain for email in batch})
+    sent = 0
+
+    for email in batch:
+        now = timezone.now()
+        if sent_counts.get(email.domain, 0) >= settings.BLOG_OUTBOX_DOMAIN_RATE:
+            # Over the domain rate limit, retry in the next window
+            email.next_attempt = now + timedelta(seconds=60)
+            email.save(update_fields=['next_attempt'])
+            continue
+
+        message = EmailMessage(
+            subject=email.subject,
+            body=email.body,
+            from_email=email.from_email or None,
+            to=[email.to],
+            connection=connection
+        )
+        try:
+            message.send()
+        except Exception as e:
+            # The SMTP session may be broken, reopen it once for the rest
+            # of the batch. A closed connection would open one per message.
+            connection.close()
+            try:
+                connection.open()
+            except Exception:
+                # Retried after the next failure, or by the next batch
+                pass
+            email.attempts += 1
+            email.last_error = f'{type(e).__name__}: {e}'
+            if email.attempts >= settings.BLOG_OUTBOX_MAX_ATTEMPTS:
+                email.status = OutboundEmail.Status.DEAD
+            else:
+                email.next_attempt = now + backoff(email.attempts)
+            email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt'])
+        else:
+            email.status = OutboundEmail.Status.SENT
+            email.sent = now
+            email.save(update_fields=['status', 'sent'])
+            sent_counts[email.domain] = sent_counts.get(email.domain, 0) + 1
+            sent += 1
+    return sent, len(batch)
@@ -0,0 +1,170 @@
+# Full-page cache for anonymous readers of the blog
+import hashlib
+import re
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .routers import PIN_COOKIE
+
+# Response header telling whether the page came from the cache
+CACHE_STATUS_HEADER = 'X-Page-Cache'
+
+# Cached pages keep a placeholder where the CSRF token of the
+# rendering request was, a fresh token is put back on every hit
+CSRF_TOKEN_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = '__blog_csrf_token__'
+
+HITS_KEY = 'blog:page:hits'
+MISSES_KEY = 'blog:page:misses'
+
+
+def get_cache():
+    return caches[settings.BLOG_PAGE_CACHE_ALIAS]
+
+
+def _digest(value):
+    return hashlib.md5(value.encode(), usedforsecurity=False).hexdigest()
+
+
+def _version_key(path):
+    return f'blog:page:version:{_digest(path)}'
+
+
+def page_key(request):
+    # Pages are versioned per path, so purging a path drops every cached
+    # query string of it at once. Scheme and host are part of the key,
+    # pages like the sitemap have absolute URLs.
+    cache = get_cache()
+    path = request.path
+    version_key = _version_key(path)
+    version = cache.get(version_key)
+    if version is None:
+        version = time.time_ns()
+        cache.add(version_key, version, None)
+        version = cache.get(version_key, version)
+    url = f'{request.scheme}://{request.get_host()}{path}?{request.META.get("QUERY_STRING", "")}'
+    return f'blog:page:{version}:{_digest(url)}'
+
+
+def purge_paths(paths):
+    version = time.time_ns()
+    get_cache().set_many({_version_key(path): version for path in paths}, None)
+
+
+def _count(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def is_shared_cache():
+    # Whether other processes see the pages and counters of this one
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def page_cache_stats():
+    cache = get_cache()
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+    }
+
+
+def is_cacheable_request(request):
+    # Readers with a session may be logged in or have pending messages,
+    # readers pinned to the primary database just posted
+    return (
+        settings.BLOG_PAGE_CACHE_ENABLED
+        and request.method in ('GET', 'HEAD')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and PIN_COOKIE not in request.COOKIES
+    )
+
+
+def is_cacheable_response(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not response.has_header('Cache-Control')
+    )
+
+
+def cached_response(request, entry):
+    content, headers = entry
+    if CSRF_PLACEHOLDER.encode() in content:
+        content = content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+    response = HttpResponse(content, headers=headers)
+    response[CACHE_STATUS_HEADER] = 'HIT'
+    return response
+
+
+def store_response(key, response):
+    content = response.content
+    if b'csrfmiddlewaretoken' in content:
+        content = CSRF_TOKEN_RE.sub(
+            rf'\g<1>{CSRF_PLACEHOLDER}\g<2>',
+            content.decode(response.charset)
+        ).encode(response.charset)
+    get_cache().set(
+        key,
+        (content, dict(response.items())),
+        settings.BLOG_PAGE_CACHE_TIMEOUT
+    )
+
+
+def lookup(request):
+    # The cache key of the request and the cached response, if any
+    key = page_key(request)
+    entry = get_cache().get(key)
+    if entry is not None:
+        _count(HITS_KEY)
+        return key, cached_response(request, entry)
+    _count(MISSES_KEY)
+    return key, None
+
+
+def store(key, response):
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    if is_cacheable_response(response):
+        store_response(key, response)
+        response[CACHE_STATUS_HEADER] = 'MISS'
+    return response
+
+
+def page_cache(view):
+    # Cache the responses of a view for anonymous readers,
+    # keyed by URL
+    if iscoroutinefunction(view):
+        # The configured page cache backends are in-process or on local
+        # disk, so their calls are made directly from the event loop
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request):
+                return await view(request, *args, **kwargs)
+            key, response = lookup(request)
+            if response is None:
+                response = store(key, await view(request, *args, **kwargs))
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable_request(request):
+            return view(request, *args, **kwargs)
+        key, response = lookup(request)
+        if response is None:
+            response = store(key, view(request, *args, **kwargs))
+        return response
+    return wrapper
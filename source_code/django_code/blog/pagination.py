@@ -0,0 +1,95 @@
+# Keyset (cursor) pagination for published posts
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page and bool(self.object_list)
+
+    def has_previous(self):
+        return self.has_previous_page and bool(self.object_list)
+
+    def next_cursor(self):
+        if self.has_next():
+            return self.paginator.encode_cursor('next', self.object_list[-1])
+
+    def previous_cursor(self):
+        if self.has_previous():
+            return self.paginator.encode_cursor('previous', self.object_list[0])
+
+
+class CursorPaginator:
+    # Pages through posts ordered by (-publish, -id). Each page is a single
+    # indexed range query, so deep pages cost the same as the first one.
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+
+    def encode_cursor(self, direction, post):
+        data = [direction, post.publish.isoformat(), post.id]
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            direction, publish, post_id = json.loads(base64.urlsafe_b64decode(cursor))
+            if direction not in ('next', 'previous'):
+                raise ValueError(direction)
+            return direction, datetime.fromisoformat(publish), int(post_id)
+        except (TypeError, ValueError):
+            raise InvalidCursor(cursor)
+
+    def page_query(self, cursor=None):
+        # The query of a page and the direction it was reached from
+        if not cursor:
+            return self.object_list.order_by('-publish', '-id')[:self.per_page + 1], None
+
+        direction, publish, post_id = self.decode_cursor(cursor)
+        if direction == 'next':
+            # Posts older than the last one of the previous page
+            return self.object_list.filter(
+                Q(publish__lt=publish) | Q(publish=publish, id__lt=post_id)
+            ).order_by('-publish', '-id')[:self.per_page + 1], direction
+
+        # Posts newer than the first one of the next page, read backwards
+        return self.object_list.filter(
+            Q(publish__gt=publish) | Q(publish=publish, id__gt=post_id)
+        ).order_by('publish', 'id')[:self.per_page + 1], direction
+
+    def build_page(self, posts, direction):
+        has_more = len(posts) > self.per_page
+        posts = posts[:self.per_page]
+        if direction is None:
+            return CursorPage(posts, self, has_more, False)
+        if direction == 'next':
+            return CursorPage(posts, self, has_more, True)
+        return CursorPage(posts[::-1], self, True, has_more)
+
+    def page(self, cursor=None):
+        query, direction = self.page_query(cursor)
+        return self.build_page(list(query), direction)
+
+    async def apage(self, cursor=None):
+        query, direction = self.page_query(cursor)
+        return self.build_page([post async for post in query], direction)
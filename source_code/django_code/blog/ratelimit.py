@@ -0,0 +1,148 @@
+# Rate limits of the form views, per client IP and per e-mail address.
+# BLOG_RATELIMITS lists the rules of every view, e.g. 'ip:5/m' (5 POSTs
+# per minute from one IP) or 'email:20/h' (20 per hour with one address
+# in the `email` field). A request over any rule gets a 429 before its
+# form is validated or the database is touched.
+#
+# Every process first takes a token from its own token bucket of the
+# rule, so a flood is turned away without a cache round trip. Requests
+# with a token are then counted in a sliding window shared through the
+# default cache, which holds the limit across processes.
+import hashlib
+import ipaddress
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+
+RULE_RE = re.compile(r'^(ip|email):(\d+)/(\d*)([smhd])$')
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Token buckets kept per process, the least recently used are dropped
+MAX_BUCKETS = 10000
+
+_buckets = OrderedDict()
+_lock = threading.Lock()
+
+
+@lru_cache
+def parse_rule(rule):
+    # 'ip:5/m' -> ('ip', 5, 60)
+    match = RULE_RE.match(rule.strip())
+    if match is None:
+        raise ImproperlyConfigured(
+            f"Invalid rate limit {rule!r}, expected e.g. 'ip:5/m' or 'email:20/h'."
+        )
+    scope, limit, count, unit = match.groups()
+    return scope, int(limit), int(count or 1) * PERIODS[unit]
+
+
+def client_ip(request):
+    # IPv6 clients get a whole /64 each, so they cannot rotate addresses
+    address = request.META.get('REMOTE_ADDR', '')
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    if ip.version == 6:
+        return str(ipaddress.ip_network(f'{ip}/64', strict=False))
+    return str(ip)
+
+
+def identity(request, scope):
+    if scope == 'ip':
+        return client_ip(request)
+    return request.POST.get('email', '').strip().lower()
+
+
+def take_token(key, limit, period):
+    # Take a token from the bucket of `key`, refilled at `limit` tokens
+    # per `period`. Return 0 on success, else the seconds until the next one.
+    now = time.monotonic()
+    with _lock:
+        tokens, updated = _buckets.pop(key, (limit, now))
+        tokens = min(limit, tokens + (now - updated) * limit / period)
+        if tokens >= 1:
+            _buckets[key] = (tokens - 1, now)
+            wait = 0
+        else:
+            _buckets[key] = (tokens, now)
+            wait = (1 - tokens) * period / limit
+        while len(_buckets) > MAX_BUCKETS:
+            _buckets.popitem(last=False)
+    return wait
+
+
+def hit_window(key, limit, period):
+    # Count a request in the sliding window of `key`: the count of the
+    # current fixed window plus the part of the previous one still inside
+    # the last `period` seconds. Return 0 if under the limit, else the
+    # seconds until the current window ends.
+    now = time.time()
+    window, elapsed = divmod(now, period)
+    current = f'{key}:{int(window)}'
+    previous = f'{key}:{int(window) - 1}'
+    counts = cache.get_many([current, previous])
+    estimate = counts.get(previous, 0) * (1 - elapsed / period) + counts.get(current, 0)
+    if estimate >= limit:
+        return period - elapsed
+    # Kept for two periods, the next window still weighs this one
+    if not cache.add(current, 1, 2 * period):
+        try:
+            cache.incr(current)
+        except ValueError:
+            # Expired in between
+            cache.add(current, 1, 2 * period)
+    return 0
+
+
+def check(request, name):
+    # Seconds the client has to wait if the request is over one of the
+    # limits of view `name`, else 0
+    for rule in settings.BLOG_RATELIMITS.get(name, ()):
+        scope, limit, period = parse_rule(rule)
+        value = identity(request, scope)
+        if not value:
+            continue
+        digest = hashlib.md5(value.encode(), usedforsecurity=False).hexdigest()
+        key = f'blog:ratelimit:{name}:{scope}:{limit}:{period}:{digest}'
+        wait = take_token(key, limit, period) or hit_window(key, limit, period)
+        if wait:
+            return wait
+    return 0
+
+
+def too_many_requests(wait):
+    response = HttpResponse(
+        'Too many requests, try again later.\n',
+        status=429,
+        content_type='text/plain'
+    )
+    response['Retry-After'] = str(int(wait) + 1)
+    return response
+
+
+def ratelimit(view):
+    # Limit the POSTs to a view with the BLOG_RATELIMITS rules of its name
+    name = view.__name__
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if settings.BLOG_RATELIMIT_ENABLED and request.method == 'POST':
+            wait = check(request, name)
+            if wait:
+                return too_many_requests(wait)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def reset():
+    # Forget the token buckets of this process
+    with _lock:
+        _buckets.clear()
@@ -0,0 +1,28 @@
+# Markdown rendering for stored post HTML
+import markdown
+from django.template.defaultfilters import truncatewords_html
+
+from .metrics import timed
+
+# Bump this whenever the rendering below changes so that
+# `rerender_posts` picks up every row rendered by an older version
+RENDERER_VERSION = 1
+
+# Number of words kept in the stored excerpt
+EXCERPT_WORDS = 30
+
+
+def render_markdown(text):
+    with timed('markdown'):
+        return markdown.markdown(text)
+
+
+def render_excerpt(html, words=EXCERPT_WORDS):
+    return truncatewords_html(html, words)
+
+
+def render_post(post):
+    # Fill the stored HTML fields of a post from its Markdown body
+    post.body_html = render_markdown(post.body)
+    post.excerpt_html = render_excerpt(post.body_html)
+    post.renderer_version = RENDERER_VERSION
@@ -0,0 +1,129 @@
+# Read replicas for the published content. Reads of the blog models go to
+# a replica from BLOG_REPLICAS, everything else and every write goes to the
+# primary ('default'). Reads stay on the primary:
+#  - for BLOG_REPLICA_PIN_SECONDS after a reader's POST (PIN_COOKIE),
+#  - for BLOG_REPLICA_PIN_SECONDS after any content write of the process
+#    (or of any process sharing the default cache), so caches purged by the
+#    write are not filled again from a replica still behind,
+#  - inside transactions, and when no replica is available.
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Models of the published content, read from the replicas
+REPLICATED_MODELS = {
+    'blog.post',
+    'blog.comment',
+    'blog.similarpost',
+    'blog.contentchange',
+    'taggit.tag',
+    'taggit.taggeditem',
+    'sites.site',
+}
+
+PIN_COOKIE = 'blog_primary'
+RECENT_WRITE_KEY = 'blog:replica:recent_write'
+
+# Whether the current request reads from the primary (None outside
+# requests) and the replica it reads from otherwise
+_pinned = ContextVar('blog_replica_pinned', default=None)
+_replica = ContextVar('blog_replica', default=None)
+
+# Replicas that failed to connect, by alias, with the time of the failure
+_unavailable = {}
+
+
+def note_write():
+    cache.set(RECENT_WRITE_KEY, True, settings.BLOG_REPLICA_PIN_SECONDS)
+
+
+def recent_write():
+    return cache.get(RECENT_WRITE_KEY, False)
+
+
+def replica_available(alias):
+    failed_at = _unavailable.get(alias)
+    if failed_at is not None and time.monotonic() - failed_at < settings.BLOG_REPLICA_RETRY_SECONDS:
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        _unavailable[alias] = time.monotonic()
+        return False
+    _unavailable.pop(alias, None)
+    return True
+
+
+def read_alias():
+    if (
+        not settings.BLOG_REPLICAS
+        or connections[DEFAULT_DB_ALIAS].in_atomic_block
+    ):
+        return DEFAULT_DB_ALIAS
+    pinned = _pinned.get()
+    if pinned is None:
+        pinned = recent_write()
+    if pinned:
+        return DEFAULT_DB_ALIAS
+    # A request keeps reading from the replica it started with
+    alias = _replica.get()
+    if alias is not None and replica_available(alias):
+        return alias
+    replicas = list(settings.BLOG_REPLICAS)
+    random.shuffle(replicas)
+    alias = next((alias for alias in replicas if replica_available(alias)), DEFAULT_DB_ALIAS)
+    if _pinned.get() is not None:
+        _replica.set(alias)
+    return alias
+
+
+@contextmanager
+def primary():
+    # Read from the primary inside the block
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+@contextmanager
+def request_routing(pinned):
+    pinned_token = _pinned.set(pinned)
+    replica_token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(replica_token)
+        _pinned.reset(pinned_token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in REPLICATED_MODELS:
+            return read_alias()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Also for instances read from a replica
+        if settings.BLOG_REPLICAS and model._meta.label_lower in REPLICATED_MODELS:
+            note_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.BLOG_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in settings.BLOG_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,304 @@
+# Signal receivers keeping cached and denormalized blog data up to date
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save
+)
+from django.dispatch import receiver
+from django.urls import reverse
+from django.utils import timezone
+from taggit.models import Tag
+
+from .cache import invalidate_comments, invalidate_sidebar
+from .feeds import LATEST, remove_feeds, schedule_feeds
+from .models import Comment, ContentChange, Post
+from .pagecache import purge_paths
+from .sitemaps import PostSitemap
+from .similar import affected_posts, update_similar_posts
+
+
+# Comment counters
+
+def adjust_comment_count(post_id, delta):
+    posts = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        posts = posts.filter(active_comment_count__gte=-delta)
+    posts.update(active_comment_count=F('active_comment_count') + delta)
+
+
+@receiver(pre_save, sender=Comment)
+def load_comment_counter_state(sender, instance, raw, **kwargs):
+    # Comments not loaded from the database need their stored state fetched
+    if raw or instance._state.adding or hasattr(instance, '_loaded_counter_state'):
+        return
+    stored = Comment.objects.filter(pk=instance.pk).values('post_id', 'active').first()
+    instance._loaded_counter_state = (
+        stored['post_id'] if stored and stored['active'] else None
+    )
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_count_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    old_post_id = None if created else instance._loaded_counter_state
+    new_post_id = instance.counter_state()
+    if old_post_id != new_post_id:
+        if old_post_id is not None:
+            adjust_comment_count(old_post_id, -1)
+        if new_post_id is not None:
+            adjust_comment_count(new_post_id, 1)
+    instance._loaded_counter_state = new_post_id
+
+
+@receiver(post_delete, sender=Comment)
+def update_comment_count_on_delete(sender, instance, **kwargs):
+    post_id = getattr(instance, '_loaded_counter_state', instance.counter_state())
+    if post_id is not None:
+        adjust_comment_count(post_id, -1)
+
+
+def tags_changed(action, pk_set):
+    # taggit's set(), used by the admin, sends post_add and post_remove
+    # with an empty pk_set when the tags stay the same
+    if action == 'post_clear':
+        return True
+    return action in ('post_add', 'post_remove') and bool(pk_set)
+
+
+# Update time of posts, which keys their cached fragments and the
+# validators of their pages, so it also changes with their tags
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def touch_post_on_tags_change(sender, instance, action, pk_set, **kwargs):
+    if tags_changed(action, pk_set) and isinstance(instance, Post):
+        instance.updated = timezone.now()
+        Post.objects.filter(pk=instance.pk).update(updated=instance.updated)
+        if action != 'post_add':
+            # The pages of the removed tags no longer join the post
+            ContentChange.record(ContentChange.Kind.TAGS_REMOVED)
+
+
+# Similar posts
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_similar_posts_on_tags_change(sender, instance, action, pk_set, **kwargs):
+    if tags_changed(action, pk_set) and isinstance(instance, Post):
+        update_similar_posts(affected_posts(instance))
+
+
+@receiver(post_save, sender=Post)
+def update_similar_posts_on_save(sender, instance, created, raw, **kwargs):
+    # New posts have no tags yet, the m2m_changed receiver handles them.
+    # Other edits only change the rankings when the post is published or
+    # unpublished, or its publish date (the tie-breaker) moves, which is
+    # what its sitemap entry holds. Connected before the page purging
+    # below, which records the new entry.
+    if created or raw:
+        return
+    if getattr(instance, '_loaded_sitemap_entry', None) != instance.sitemap_entry():
+        update_similar_posts(affected_posts(instance))
+
+
+@receiver(pre_delete, sender=Post)
+def load_similar_posts_neighbours(sender, instance, **kwargs):
+    instance._similar_neighbours = affected_posts(instance) - {instance.pk}
+
+
+@receiver(post_delete, sender=Post)
+def update_similar_posts_on_delete(sender, instance, **kwargs):
+    update_similar_posts(getattr(instance, '_similar_neighbours', ()))
+
+
+# Feeds, rebuilt when a listed post changes. Connected before the page
+# purging below, which records the new sitemap entry of the post.
+
+@receiver(post_save, sender=Post)
+def rebuild_feeds_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    old_entry = None if created else getattr(instance, '_loaded_sitemap_entry', None)
+    if old_entry or instance.sitemap_entry():
+        schedule_feeds([LATEST, *post_tag_slugs(instance)])
+
+
+@receiver(pre_delete, sender=Post)
+def load_feed_tag_slugs(sender, instance, **kwargs):
+    instance._feed_tag_slugs = post_tag_slugs(instance)
+
+
+@receiver(post_delete, sender=Post)
+def rebuild_feeds_on_delete(sender, instance, **kwargs):
+    if getattr(instance, '_loaded_sitemap_entry', instance.sitemap_entry()):
+        schedule_feeds([LATEST, *instance._feed_tag_slugs])
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def rebuild_feeds_on_tags_change(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Post) or not instance.sitemap_entry():
+        return
+    if action == 'pre_clear':
+        instance._feed_tag_slugs = post_tag_slugs(instance)
+    elif action == 'post_clear':
+        schedule_feeds(instance._feed_tag_slugs)
+    elif action in ('post_add', 'post_remove'):
+        schedule_feeds(Tag.objects.filter(pk__in=pk_set).values_list('slug', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def remove_tag_feeds(sender, instance, **kwargs):
+    remove_feeds(instance.slug)
+
+
+# Deletion times, which the conditional GET validators include
+
+@receiver(post_delete, sender=Post)
+def record_post_deletion(sender, instance, **kwargs):
+    ContentChange.record(ContentChange.Kind.POST_DELETED)
+
+
+@receiver(post_delete, sender=Comment)
+def record_comment_deletion(sender, instance, **kwargs):
+    ContentChange.record(ContentChange.Kind.COMMENT_DELETED)
+
+
+# Caches, connected last so they see the updated counters
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_sidebar_cache(sender, **kwargs):
+    invalidate_sidebar()
+
+
+@receiver(pre_save, sender=Comment)
+def load_comment_thread(sender, instance, raw, **kwargs):
+    # The thread showing the comment before the save, from the stored
+    # state loaded for the counters (which post_save overwrites)
+    if not raw:
+        instance._loaded_thread_post_id = getattr(instance, '_loaded_counter_state', None)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_thread(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    post_ids = {instance.post_id, getattr(instance, '_loaded_thread_post_id', None)}
+    invalidate_comments(post_ids - {None})
+
+
+def purge_pages(paths):
+    # Purge now and again once the transaction commits, so a page
+    # rendered from the old rows in between does not stay cached
+    paths = set(paths)
+    purge_paths(paths)
+    transaction.on_commit(partial(purge_paths, paths))
+
+
+def post_pages(post, tag_slugs=()):
+    # Pages showing the post: its detail page, the post lists,
+    # the pages of its tags and the sitemap index
+    return {
+        post.get_absolute_url(),
+        reverse('blog:post_list'),
+        reverse('blog:django.contrib.sitemaps.views.sitemap'),
+        *(reverse('blog:post_list_by_tag', args=[slug]) for slug in tag_slugs),
+    }
+
+
+def sitemap_pages(old_entry, new_entry):
+    # Child sitemap pages listing the post before and after a change.
+    # An edit only changes the page of the post, while adding, removing
+    # or moving it shifts the pages after it.
+    sitemap = PostSitemap()
+    if old_entry == new_entry:
+        pages = [sitemap.page_of(new_entry)] if new_entry else []
+    else:
+        first = min(sitemap.page_of(entry) for entry in (old_entry, new_entry) if entry)
+        # Up to the last page before a removal
+        pages = range(first, sitemap.num_pages() + 2)
+    return {
+        reverse('blog:sitemap_section', kwargs={'section': 'posts', 'page': page})
+        for page in pages
+    }
+
+
+def post_tag_slugs(post):
+    return list(post.tags.values_list('slug', flat=True))
+
+
+@receiver(pre_save, sender=Post)
+def load_post_sitemap_entry(sender, instance, raw, **kwargs):
+    # Posts not loaded from the database need their stored entry fetched
+    if raw or instance._state.adding or hasattr(instance, '_loaded_sitemap_entry'):
+        return
+    stored = Post.objects.filter(pk=instance.pk).only('status', 'publish').first()
+    instance._loaded_sitemap_entry = stored.sitemap_entry() if stored else None
+
+
+@receiver(post_save, sender=Post)
+def purge_post_pages_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    paths = post_pages(instance, post_tag_slugs(instance))
+    new_entry = instance.sitemap_entry()
+    old_entry = None if created else getattr(instance, '_loaded_sitemap_entry', None)
+    paths |= sitemap_pages(old_entry, new_entry)
+    instance._loaded_sitemap_entry = new_entry
+    # The post moved to another URL
+    loaded_url_parts = getattr(instance, '_loaded_url_parts', None)
+    if loaded_url_parts and loaded_url_parts != (instance.publish, instance.slug):
+        publish, slug = loaded_url_parts
+        paths.add(reverse(
+            'blog:post_detail',
+            args=[publish.year, publish.month, publish.day, slug]
+        ))
+    instance._loaded_url_parts = (instance.publish, instance.slug)
+    purge_pages(paths)
+
+
+@receiver(pre_delete, sender=Post)
+def load_post_pages(sender, instance, **kwargs):
+    instance._purge_paths = post_pages(instance, post_tag_slugs(instance))
+
+
+@receiver(post_delete, sender=Post)
+def purge_post_pages_on_delete(sender, instance, **kwargs):
+    paths = getattr(instance, '_purge_paths', post_pages(instance))
+    entry = getattr(instance, '_loaded_sitemap_entry', instance.sitemap_entry())
+    purge_pages(paths | sitemap_pages(entry, None))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def purge_post_pages_on_tags_change(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Post):
+        return
+    if action == 'pre_clear' or (action == 'pre_remove' and pk_set):
+        # Removed tags no longer list the post afterwards
+        instance._purge_tag_slugs = post_tag_slugs(instance)
+    elif tags_changed(action, pk_set):
+        tag_slugs = {*post_tag_slugs(instance), *getattr(instance, '_purge_tag_slugs', ())}
+        # The sitemap page of the post shows its new lastmod
+        entry = instance.sitemap_entry()
+        purge_pages(post_pages(instance, tag_slugs) | sitemap_pages(entry, entry))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def purge_comment_pages(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    try:
+        post = instance.post
+    except Post.DoesNotExist:
+        # The comment is deleted along with its post
+        return
+    purge_pages([post.get_absolute_url(), reverse('blog:post_list')])
@@ -0,0 +1,81 @@
+# Precomputed similar posts, based on tag co-occurrence
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from taggit.models import TaggedItem
+
+from .models import Post, SimilarPost
+
+# Number of similar posts kept per post
+SIMILAR_POSTS = 4
+
+# Counts the tags shared by every post of a batch with every other published
+# post in a single statement and keeps the best ranked ones per post
+SIMILAR_POSTS_SQL = f'''
+    SELECT post_id, similar_post_id, shared_tag_count, rank FROM (
+        SELECT
+            a.object_id AS post_id,
+            b.object_id AS similar_post_id,
+            COUNT(*) AS shared_tag_count,
+            ROW_NUMBER() OVER (
+                PARTITION BY a.object_id
+                ORDER BY COUNT(*) DESC, p.publish DESC, p.id DESC
+            ) AS rank
+        FROM {TaggedItem._meta.db_table} a
+        JOIN {TaggedItem._meta.db_table} b
+            ON b.tag_id = a.tag_id
+            AND b.content_type_id = a.content_type_id
+            AND b.object_id <> a.object_id
+        JOIN {Post._meta.db_table} p ON p.id = b.object_id
+        WHERE a.content_type_id = %s
+            AND a.object_id = ANY(%s)
+            AND p.status = %s
+        GROUP BY a.object_id, b.object_id, p.publish, p.id
+    ) ranked
+    WHERE rank <= %s
+'''
+
+
+def compute_similar_posts(post_ids):
+    content_type = ContentType.objects.get_for_model(Post)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            SIMILAR_POSTS_SQL,
+            [content_type.id, list(post_ids), Post.Status.PUBLISHED, SIMILAR_POSTS]
+        )
+        return [
+            SimilarPost(
+                post_id=post_id,
+                similar_post_id=similar_post_id,
+                shared_tag_count=shared_tag_count,
+                rank=rank
+            )
+            for post_id, similar_post_id, shared_tag_count, rank in cursor.fetchall()
+        ]
+
+
+def update_similar_posts(post_ids, batch_size=500):
+    # Replace the similar posts of the given posts, batch by batch
+    post_ids = sorted(post_ids)
+    for start in range(0, len(post_ids), batch_size):
+        batch = post_ids[start:start + batch_size]
+        with transaction.atomic():
+            SimilarPost.objects.filter(post_id__in=batch).delete()
+            SimilarPost.objects.bulk_create(compute_similar_posts(batch))
+
+
+def affected_posts(post):
+    # Posts whose similar posts may change when this post changes:
+    # the post itself, posts sharing one of its tags and posts listing it
+    content_type = ContentType.objects.get_for_model(Post)
+    tag_ids = TaggedItem.objects.filter(
+        content_type=content_type,
+        object_id=post.pk
+    ).values('tag_id')
+    neighbours = TaggedItem.objects.filter(
+        content_type=content_type,
+        tag_id__in=tag_ids
+    ).values_list('object_id', flat=True)
+    listing = SimilarPost.objects.filter(
+        similar_post_id=post.pk
+    ).values_list('post_id', flat=True)
+    return {post.pk, *neighbours, *listing}
@@ -1,12 +1,74 @@
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.xmlutils import SimplerXMLGenerator
 from .models import Post
 
+# Last change of every child sitemap page, in a single pass over the index
+PAGE_LASTMODS_SQL = f'''
+    SELECT page, MAX(updated)
+    FROM (
+        SELECT
+            (ROW_NUMBER() OVER (ORDER BY publish, id) - 1) / %s + 1 AS page,
+            updated
+        FROM {Post._meta.db_table}
+        WHERE status = %s
+    ) pages
+    GROUP BY page
+    ORDER BY page
+'''
+
 class PostSitemap(Sitemap):
+    # Split into child pages of BLOG_SITEMAP_LIMIT posts listed by a
+    # sitemap index. Posts are ordered oldest first, so new posts only
+    # change the last page and edits only change the page of the post.
     changefreq = 'weekly'
     priority = 0.9
-    
+
+    @property
+    def limit(self):
+        return settings.BLOG_SITEMAP_LIMIT
+
     def items(self):
-        return Post.published.all()
+        # Only the fields needed for the location and lastmod
+        return Post.published.order_by('publish', 'id').only('slug', 'publish', 'updated')
 
     def lastmod(self, obj):
-        return obj.updated
\ No newline at end of file
+        return obj.updated
+
+    def num_pages(self):
+        return Paginator(self.items(), self.limit).num_pages
+
+    def page_lastmods(self):
+        with connections[router.db_for_read(Post)].cursor() as cursor:
+            cursor.execute(PAGE_LASTMODS_SQL, [self.limit, Post.Status.PUBLISHED])
+            return cursor.fetchall() or [(1, None)]
+
+    def page_items(self, page):
+        # Posts of a page streamed from the database, raises InvalidPage
+        return Paginator(self.items(), self.limit).page(page).object_list.iterator(chunk_size=1000)
+
+    def page_of(self, entry):
+        # Page listing the sitemap entry (publish, id) of a post
+        publish, post_id = entry
+        position = Post.published.filter(
+            Q(publish__lt=publish) | Q(publish=publish, id__lt=post_id)
+        ).count()
+        return position // self.limit + 1
+
+    def write_page(self, out, page, protocol, domain):
+        handler = SimplerXMLGenerator(out, 'utf-8')
+        handler.startDocument()
+        handler.startElement('urlset', {'xmlns': 'http://www.sitemaps.org/schemas/sitemap/0.9'})
+        for item in self.page_items(page):
+            handler.startElement('url', {})
+            handler.addQuickElement('loc', f'{protocol}://{domain}{self.location(item)}')
+            handler.addQuickElement('lastmod', timezone.localdate(self.lastmod(item)).isoformat())
+            handler.addQuickElement('changefreq', self.changefreq)
+            handler.addQuickElement('priority', str(self.priority))
+            handler.endElement('url')
+        handler.endElement('urlset')
+        handler.endDocument()
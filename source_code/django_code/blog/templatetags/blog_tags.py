@@ -1,31 +1,47 @@
-import markdown
 from django import template
-from django.db.models import Count
 from django.utils.safestring import mark_safe
 
+from ..cache import get_sidebar
 from ..models import Post
+from ..rendering import render_markdown
 
 register = template.Library()
 
 
+# Sidebar queries, also used by the async views to load the sidebar ahead
+
+def latest_posts(count):
+    return Post.published.for_links().order_by('-publish')[:count]
+
+
+def most_commented_posts(count):
+    return Post.published.for_links().order_by('-active_comment_count')[:count]
+
+
 @register.simple_tag
 def total_posts():
-    return Post.published.count()
+    return get_sidebar('total_posts', Post.published.count)
 
 
 @register.inclusion_tag('blog/post/latest_posts.html')
 def show_latest_posts(count=5):
-    latest_posts = Post.published.order_by('-publish')[:count]
-    return {'latest_posts': latest_posts}
+    latest_posts_list = get_sidebar(
+        'latest_posts',
+        lambda: list(latest_posts(count)),
+        count
+    )
+    return {'latest_posts': latest_posts_list}
 
 
 @register.simple_tag
 def get_most_commented_posts(count=5):
-    return Post.published.annotate(
-        total_comments=Count('comments')
-    ).order_by('-total_comments')[:count]
+    return get_sidebar(
+        'most_commented_posts',
+        lambda: list(most_commented_posts(count)),
+        count
+    )
 
 
 @register.filter(name='markdown')
 def markdown_format(text):
-    return mark_safe(markdown.markdown(text))
\ No newline at end of file
+    return mark_safe(render_markdown(text))
\ No newline at end of file
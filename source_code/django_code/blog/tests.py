@@ -1,11 +1,57 @@
-from django.test import TestCase
+import json
+import logging
+import re
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.http import Http404, HttpResponse
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.test import AsyncRequestFactory, Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.text import slugify
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from taggit.models import Tag
-from .models import Post, Comment
+from project.log import JsonFormatter, QueueHandler, logging_config
+from . import async_views, commentqueue, feeds, ratelimit, routers
+from .archive import export_records
+from .conditional import post_condition
+from .metrics import render_metrics, reset_metrics
+from .middleware import MetricsMiddleware, ReplicaMiddleware
+from .models import Post, Comment, SimilarPost, OutboundEmail, post_url
+from .pagecache import CACHE_STATUS_HEADER, CSRF_PLACEHOLDER, page_cache, page_cache_stats
 from .forms import EmailPostForm, CommentForm
+from .outbox import queue_mail
+from .rendering import RENDERER_VERSION
+from .templatetags import blog_tags
+
+
+# Feed files are written to a temporary directory during the tests
+feed_root_settings = override_settings(BLOG_FEED_ROOT=tempfile.mkdtemp(), BLOG_FEED_DEBOUNCE=0)
+
+def setUpModule():
+    feed_root_settings.enable()
+
+def tearDownModule():
+    shutil.rmtree(settings.BLOG_FEED_ROOT, ignore_errors=True)
+    feed_root_settings.disable()
+
+def clear_feeds():
+    # Feeds written by a previous test show its rolled back posts
+    shutil.rmtree(settings.BLOG_FEED_ROOT, ignore_errors=True)
 
 class BlogTests(TestCase):
 
@@ -99,6 +145,9 @@ class BlogTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'blog/post/share.html')
         self.assertTrue(response.context['sent'])
+        # The e-mail is queued and sent by the outbox worker
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('send_outbox', stdout=StringIO())
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, f"John Doe (john@example.com) recommends you read {self.published_posts[0].title}")
 
@@ -144,3 +193,1470 @@ class BlogTests(TestCase):
         post = self.published_posts[0]
         post.tags.add(tag)
         self.assertIn(tag, post.tags.all())
+
+    def test_post_body_rendered_on_save(self):
+        post = self.published_posts[0]
+        post.body = '**Bold** ' + ' '.join(['word'] * 40)
+        post.save()
+        post.refresh_from_db()
+        self.assertIn('<strong>Bold</strong>', post.body_html)
+        self.assertIn('<strong>Bold</strong>', post.excerpt_html)
+        self.assertTrue(post.excerpt_html.rstrip('</p>').endswith('…'))
+        self.assertEqual(post.renderer_version, RENDERER_VERSION)
+
+    def test_rerender_posts_command(self):
+        # Simulate rows rendered by an older renderer
+        Post.objects.update(body_html='', excerpt_html='', renderer_version=0)
+        call_command('rerender_posts', batch_size=2, stdout=StringIO())
+        for post in Post.objects.all():
+            self.assertEqual(post.renderer_version, RENDERER_VERSION)
+            self.assertEqual(post.body_html, f'<p>{post.body}</p>')
+
+
+class QueryBudgetMixin:
+    # Fails when a view needs more queries than its budget,
+    # e.g. because a related lookup runs once per post again
+    def assertQueryBudget(self, budget, url, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **kwargs)
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+        return response
+
+
+class PostTestCase(TestCase):
+    # Tests of posts by a single author, created with create_post
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser')
+
+    def create_post(self, title, **fields):
+        # A published post by the author, unless `fields` say otherwise
+        fields.setdefault('slug', slugify(title))
+        fields.setdefault('body', f'This is a {title.lower()}.')
+        fields.setdefault('author', self.user)
+        fields.setdefault('status', Post.Status.PUBLISHED)
+        return Post.objects.create(title=title, **fields)
+
+
+@override_settings(BLOG_PAGE_CACHE_ENABLED=False)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        clear_feeds()
+        # Give every post its own author and several tags
+        for i in range(1, 11):
+            user = get_user_model().objects.create_user(username=f'author{i}')
+            post = Post.objects.create(
+                title=f'Budget Post {i}',
+                slug=f'budget-post-{i}',
+                body=f'This is budget post {i}.',
+                author=user,
+                status=Post.Status.PUBLISHED
+            )
+            post.tags.add('common', f'tag{i}', f'other{i}')
+
+    def test_post_list_query_budget(self):
+        # Validator + count + page + tags prefetch, plus three sidebar queries
+        response = self.assertQueryBudget(7, reverse('blog:post_list'))
+        self.assertEqual(response.status_code, 200)
+        response = self.assertQueryBudget(7, reverse('blog:post_list') + '?page=3')
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_detail_query_budget(self):
+        # Validator + post with author + comments + similar posts,
+        # plus three sidebar queries, however many similar posts
+        post = Post.objects.get(slug='budget-post-1')
+        self.assertEqual(post.similar_entries.count(), 4)
+        for i in range(3):
+            Comment.objects.create(post=post, name=f'Reader {i}', email='r@example.com', body='Hi')
+        cache.clear()
+        response = self.assertQueryBudget(7, post.get_absolute_url())
+        self.assertEqual(len(response.context['similar_posts']), 4)
+        self.assertContains(response, 'Reader 2')
+
+    def test_post_list_by_tag_query_budget(self):
+        # Tag lookup on top of the post list budget
+        url = reverse('blog:post_list_by_tag', args=['common'])
+        response = self.assertQueryBudget(8, url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_feed_query_budget(self):
+        # Served from the pre-generated feed file
+        call_command('build_feeds', stdout=StringIO())
+        response = self.assertQueryBudget(0, reverse('blog:post_feed'))
+        self.assertEqual(response.status_code, 200)
+        response = self.assertQueryBudget(0, reverse('blog:post_feed_by_tag', args=['common']))
+        self.assertContains(response, 'Budget Post 10')
+
+    def test_listings_defer_body(self):
+        # Listings and the sidebar never load the post body
+        urls = [
+            reverse('blog:post_list'),
+            reverse('blog:post_list_by_tag', args=['common']),
+            reverse('blog:post_search') + '?query=budget',
+        ]
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, 'Budget Post 10')
+            for query in queries.captured_queries:
+                self.assertNotIn('"blog_post"."body"', query['sql'])
+        with CaptureQueriesContext(connection) as queries:
+            feeds.render_feeds()
+        self.assertNotIn('"blog_post"."body"', queries.captured_queries[0]['sql'])
+
+
+@override_settings(BLOG_PAGE_CACHE_ENABLED=False)
+class SidebarCacheTests(QueryBudgetMixin, PostTestCase):
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        self.post = self.create_post('Cached Post')
+
+    def test_sidebar_served_from_cache(self):
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        # Validator + count + page + tags prefetch, the sidebar comes from the cache
+        self.assertQueryBudget(4, url)
+
+    def test_sidebar_invalidated_on_post_save(self):
+        url = reverse('blog:post_list')
+        self.assertContains(self.client.get(url), "I've written 1 posts")
+        self.create_post('Another Post')
+        self.assertContains(self.client.get(url), "I've written 2 posts")
+
+    def test_sidebar_invalidated_on_comment_save(self):
+        other = self.create_post('Other Post')
+        Comment.objects.create(post=self.post, name='Jane', email='jane@example.com', body='Hi')
+        most_commented = blog_tags.get_most_commented_posts(1)
+        self.assertEqual(most_commented, [self.post])
+        for i in range(2):
+            Comment.objects.create(post=other, name='Jane', email='jane@example.com', body='Hi')
+        self.assertEqual(blog_tags.get_most_commented_posts(1), [other])
+
+
+class CommentCounterTests(PostTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.post = self.create_post('Counted Post')
+
+    def add_comment(self, **kwargs):
+        return Comment.objects.create(
+            post=self.post, name='Jane', email='jane@example.com', body='Hi', **kwargs
+        )
+
+    def assertCount(self, expected):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.active_comment_count, expected)
+
+    def test_counter_follows_comment_changes(self):
+        comment = self.add_comment()
+        self.add_comment(active=False)
+        self.assertCount(1)
+
+        # Toggling the comment as CommentAdmin does
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.active = False
+        comment.save()
+        self.assertCount(0)
+        comment.active = True
+        comment.save()
+        self.assertCount(1)
+
+        Comment.objects.filter(pk=comment.pk).delete()
+        self.assertCount(0)
+
+    def test_counter_not_overwritten_by_stale_post(self):
+        stale_post = Post.objects.get(pk=self.post.pk)
+        self.add_comment()
+        stale_post.title = 'Edited Post'
+        stale_post.save()
+        self.assertCount(1)
+
+    def test_deferred_post_saves_loaded_fields_only(self):
+        post = Post.published.for_links().get(pk=self.post.pk)
+        post.title = 'Edited Post'
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        updates = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "blog_post" SET "title"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"body"', updates[0])
+        # The deferred body was neither loaded nor rendered again
+        self.assertIn('body', post.get_deferred_fields())
+        stored = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((stored.title, stored.body), ('Edited Post', 'This is a counted post.'))
+        self.assertEqual(stored.body_html, self.post.body_html)
+
+    def test_post_comment_view_updates_counter(self):
+        self.client.post(reverse('blog:post_comment', args=[self.post.id]), {
+            'name': 'Jane Doe',
+            'email': 'jane@example.com',
+            'body': 'This is a test comment.'
+        })
+        self.assertCount(1)
+
+    def test_reconcile_comment_counts_command(self):
+        self.add_comment()
+        self.add_comment()
+        Post.objects.update(active_comment_count=7)
+        call_command('reconcile_comment_counts', stdout=StringIO())
+        self.assertCount(2)
+
+
+@override_settings(BLOG_COMMENTS_PER_PAGE=2, BLOG_PAGE_CACHE_ENABLED=False)
+class CommentThreadTests(PostTestCase):
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        self.post = self.create_post('Discussed Post')
+        self.comments = [
+            Comment.objects.create(post=self.post, name=f'Reader {i}', email='r@example.com', body=f'Remark {i}')
+            for i in range(1, 6)
+        ]
+        self.url = self.post.get_absolute_url()
+
+    def comment_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        # Comment rows, as opposed to the MAX(updated) of the validator
+        return response, [q['sql'] for q in queries.captured_queries if '"blog_comment"' in q['sql']]
+
+    def test_comments_paginated(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, '5 comments')
+        self.assertContains(response, 'Comment 2 by Reader 2')
+        self.assertNotContains(response, 'Remark 3')
+        self.assertContains(response, 'Comments page 1 of 3.')
+        response = self.client.get(self.url + '?comments=3')
+        self.assertContains(response, 'Comment 5 by Reader 5')
+        self.assertNotContains(response, 'Remark 4')
+        response = self.client.get(self.url + '?comments=99')
+        self.assertContains(response, 'Comments page 3 of 3.')
+
+    def test_thread_rendered_once(self):
+        response, queries = self.comment_queries(self.url)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.comment_queries(self.url)
+        self.assertEqual(queries, [])
+        self.assertContains(response, 'Remark 2')
+
+    def test_comment_changes_invalidate_thread(self):
+        self.client.get(self.url)
+        comment = self.comments[0]
+        comment.body = 'Edited remark'
+        comment.save()
+        self.assertContains(self.client.get(self.url), 'Edited remark')
+        comment.active = False
+        comment.save()
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Edited remark')
+        self.assertContains(response, 'Comment 1 by Reader 2')
+
+
+@override_settings(BLOG_PAGINATION='cursor', BLOG_PAGE_CACHE_ENABLED=False)
+class CursorPaginationTests(QueryBudgetMixin, PostTestCase):
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        publish = timezone.now()
+        self.posts = []
+        for i in range(8):
+            post = self.create_post(
+                f'Paged Post {i}',
+                # Two posts share each publish date to exercise the id tie-break
+                publish=publish - timezone.timedelta(days=i // 2)
+            )
+            post.tags.add('paged' if i % 2 else 'odd')
+            self.posts.append(post)
+        # Newest first, ties broken by the highest id
+        self.posts.sort(key=lambda post: (post.publish, post.id), reverse=True)
+
+    def test_walk_pages_forward_and_back(self):
+        url = reverse('blog:post_list')
+        response = self.client.get(url)
+        pages = [list(response.context['posts'])]
+        self.assertTemplateUsed(response, 'cursor_pagination.html')
+        while response.context['posts'].has_next():
+            response = self.client.get(url, {'cursor': response.context['posts'].next_cursor()})
+            pages.append(list(response.context['posts']))
+        self.assertEqual([post for page in pages for post in page], self.posts)
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+
+        # Walk back to the first page
+        page = response.context['posts']
+        while page.has_previous():
+            page = self.client.get(url, {'cursor': page.previous_cursor()}).context['posts']
+            self.assertEqual(list(page), pages.pop(-2))
+        self.assertEqual(list(page), self.posts[:3])
+
+    def test_deep_page_costs_the_same(self):
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        response = self.client.get(url)
+        cursor = response.context['posts'].next_cursor()
+        cursor = self.client.get(url, {'cursor': cursor}).context['posts'].next_cursor()
+        # Validator + page + tags prefetch, the sidebar is cached
+        self.assertQueryBudget(3, url, data={'cursor': cursor})
+
+    def test_cursor_on_tag_list(self):
+        url = reverse('blog:post_list_by_tag', args=['paged'])
+        response = self.client.get(url)
+        cursor = response.context['posts'].next_cursor()
+        response = self.client.get(url, {'cursor': cursor})
+        self.assertEqual(len(response.context['posts']), 1)
+        self.assertFalse(response.context['posts'].has_next())
+
+    def test_invalid_cursor_shows_first_page(self):
+        response = self.client.get(reverse('blog:post_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['posts']), self.posts[:3])
+
+
+class PostSearchTests(QueryBudgetMixin, PostTestCase):
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        self.title_match = self.create_post('Django performance', body='Notes on caching.')
+        self.body_match = self.create_post('Caching notes', body='How we made Django faster.')
+        self.create_post('Django draft', body='Not published yet.', status=Post.Status.DRAFT)
+
+    def search(self, query):
+        return self.client.get(reverse('blog:post_search'), {'query': query})
+
+    def test_search_ranks_title_above_body(self):
+        response = self.search('django')
+        self.assertEqual(list(response.context['results']), [self.title_match, self.body_match])
+        self.assertContains(response, 'Found 2 results')
+
+    def test_search_vector_updated_on_save(self):
+        self.body_match.body = 'Nothing to see here.'
+        self.body_match.save()
+        self.assertEqual(list(self.search('django').context['results']), [self.title_match])
+
+    def test_search_falls_back_to_trigram_title_match(self):
+        response = self.search('Djnago performance')
+        self.assertEqual(list(response.context['results']), [self.title_match])
+
+    def test_trigram_match_below_default_threshold(self):
+        # 'Djnago' is 0.13 similar to 'Django performance', under the 0.3
+        # default of pg_trgm but over the 0.1 of the search
+        response = self.search('Djnago')
+        self.assertEqual(list(response.context['results']), [self.title_match])
+        response = self.search('perfromance tuning')
+        self.assertEqual(list(response.context['results']), [self.title_match])
+
+    def test_search_query_budget(self):
+        self.search('django')
+        # Search + tags prefetch, the sidebar is cached
+        self.assertQueryBudget(2, reverse('blog:post_search'), data={'query': 'django'})
+
+
+class SimilarPostTests(PostTestCase):
+
+    def setUp(self):
+        super().setUp()
+        publish = timezone.now()
+        self.posts = {}
+        for i, tags in enumerate([['a', 'b', 'c'], ['a', 'b'], ['a'], ['c'], ['d']]):
+            post = self.create_post(f'Similar Post {i}', publish=publish - timezone.timedelta(days=i))
+            post.tags.add(*tags)
+            self.posts[i] = post
+
+    def similar(self, i):
+        return [
+            (entry.similar_post_id, entry.shared_tag_count)
+            for entry in SimilarPost.objects.filter(post=self.posts[i])
+        ]
+
+    def test_similar_posts_ranked_by_shared_tags(self):
+        posts = self.posts
+        self.assertEqual(
+            self.similar(0),
+            [(posts[1].pk, 2), (posts[2].pk, 1), (posts[3].pk, 1)]
+        )
+        self.assertEqual(self.similar(4), [])
+
+    def test_similar_posts_follow_tag_changes(self):
+        posts = self.posts
+        posts[4].tags.add('a', 'b', 'c')
+        self.assertEqual(self.similar(0)[0], (posts[4].pk, 3))
+        self.assertIn((posts[0].pk, 3), self.similar(4))
+        posts[4].tags.clear()
+        self.assertEqual(self.similar(4), [])
+        self.assertNotIn(posts[4].pk, [post_id for post_id, count in self.similar(0)])
+
+    def test_similar_posts_skip_drafts_and_deleted_posts(self):
+        posts = self.posts
+        posts[1].status = Post.Status.DRAFT
+        posts[1].save()
+        self.assertEqual(self.similar(0), [(posts[2].pk, 1), (posts[3].pk, 1)])
+        posts[2].delete()
+        self.assertEqual(self.similar(0), [(posts[3].pk, 1)])
+
+    def test_similar_posts_follow_publish_date(self):
+        posts = self.posts
+        # Ties on shared tags go to the latest post
+        posts[3].publish = timezone.now() + timezone.timedelta(days=1)
+        posts[3].save()
+        self.assertEqual(
+            self.similar(0),
+            [(posts[1].pk, 2), (posts[3].pk, 1), (posts[2].pk, 1)]
+        )
+
+    def test_title_edit_keeps_similar_posts(self):
+        expected = self.similar(0)
+        post = Post.objects.get(pk=self.posts[1].pk)
+        post.title = 'Renamed Similar Post'
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        self.assertFalse([
+            query['sql'] for query in queries.captured_queries
+            if '"blog_similarpost"' in query['sql']
+            and query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ])
+        self.assertEqual(self.similar(0), expected)
+
+    def test_admin_edit_with_same_tags_keeps_similar_posts(self):
+        admin = get_user_model().objects.create_superuser(username='admin', password='secret')
+        self.client.force_login(admin)
+        post = self.posts[0]
+        # The admin form has no microseconds
+        Post.objects.filter(pk=post.pk).update(publish=post.publish.replace(microsecond=0))
+        post.refresh_from_db()
+        with patch('blog.signals.update_similar_posts') as update_similar:
+            response = self.client.post(
+                reverse('admin:blog_post_change', args=[post.pk]),
+                {
+                    'title': 'Renamed Similar Post',
+                    'slug': post.slug,
+                    'author': self.user.pk,
+                    'body': post.body,
+                    'publish_0': post.publish.strftime('%Y-%m-%d'),
+                    'publish_1': post.publish.strftime('%H:%M:%S'),
+                    'status': post.status,
+                    'tags': 'a, b, c',
+                }
+            )
+        self.assertEqual(response.status_code, 302)
+        update_similar.assert_not_called()
+        post.refresh_from_db()
+        self.assertEqual(post.title, 'Renamed Similar Post')
+        self.assertEqual(sorted(post.tags.names()), ['a', 'b', 'c'])
+
+    def test_rebuild_similar_posts_command(self):
+        expected = self.similar(0)
+        SimilarPost.objects.all().delete()
+        call_command('rebuild_similar_posts', batch_size=2, stdout=StringIO())
+        self.assertEqual(self.similar(0), expected)
+
+    def test_post_detail_shows_similar_posts(self):
+        post = self.posts[0]
+        response = self.client.get(post.get_absolute_url())
+        self.assertEqual(
+            response.context['similar_posts'],
+            [self.posts[1], self.posts[2], self.posts[3]]
+        )
+
+
+class ExplainQueriesTests(PostTestCase):
+
+    def setUp(self):
+        clear_feeds()
+        super().setUp()
+        self.post = self.create_post('Explained Post', publish=timezone.now().replace(hour=23, minute=59))
+        self.post.tags.add('explained')
+        Comment.objects.create(post=self.post, name='Jane', email='jane@example.com', body='Hi')
+
+    def test_detail_lookup_by_publish_range(self):
+        publish = self.post.publish
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertContains(response, 'Explained Post')
+        for year, month, day in [(publish.year, 2, 30), (publish.year, 13, 1)]:
+            url = reverse('blog:post_detail', args=[year, month, day, self.post.slug])
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_explain_queries(self):
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertIn('post_detail: ', out.getvalue())
+        self.assertIn('No sequential scans of large tables.', out.getvalue())
+        # The planner scans the tiny test tables sequentially
+        with self.assertRaises(CommandError):
+            call_command('explain_queries', min_rows=0, stdout=StringIO())
+
+
+class PageCacheTests(QueryBudgetMixin, PostTestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['pages'].clear()
+        super().setUp()
+        self.post = self.create_post('Cached Page Post')
+        self.post.tags.add('cached')
+
+    def test_anonymous_pages_served_from_cache(self):
+        for url in [
+            reverse('blog:post_list'),
+            reverse('blog:post_list') + '?page=1',
+            self.post.get_absolute_url(),
+            reverse('blog:post_list_by_tag', args=['cached']),
+            reverse('blog:django.contrib.sitemaps.views.sitemap'),
+        ]:
+            first = self.client.get(url)
+            self.assertEqual(first[CACHE_STATUS_HEADER], 'MISS')
+            # Only the conditional GET validator query is left
+            second = self.assertQueryBudget(1, url)
+            self.assertEqual(second[CACHE_STATUS_HEADER], 'HIT')
+            self.assertEqual(second['Content-Type'], first['Content-Type'])
+        self.assertEqual(page_cache_stats(), {'hits': 5, 'misses': 5})
+        self.assertIn('blog_page_cache_hits_total 5', render_metrics())
+
+    def test_stats_command_needs_a_shared_cache(self):
+        # The locmem counters of the server processes are not readable here
+        with self.assertRaisesMessage(CommandError, '/blog/metrics/'):
+            call_command('page_cache_stats', stdout=StringIO())
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        pages = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': path}
+        with override_settings(CACHES={**settings.CACHES, 'pages': pages}):
+            self.client.get(reverse('blog:post_list'))
+            self.client.get(reverse('blog:post_list'))
+            out = StringIO()
+            call_command('page_cache_stats', stdout=out)
+        self.assertEqual(out.getvalue(), 'Hits: 1\nMisses: 1\nHit ratio: 50.0%\n')
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'blog.example.com'])
+    def test_pages_cached_per_scheme_and_host(self):
+        url = reverse('blog:django.contrib.sitemaps.views.sitemap')
+        response = self.client.get(url)
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'MISS')
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'MISS')
+        self.assertContains(response, '<loc>https://')
+        response = self.client.get(url, headers={'host': 'blog.example.com'})
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'MISS')
+        response = self.client.get(url)
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'HIT')
+        self.assertContains(response, '<loc>http://')
+
+    def test_session_cookie_bypasses_cache(self):
+        self.client.force_login(self.user)
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        self.assertFalse(self.client.get(url).has_header(CACHE_STATUS_HEADER))
+
+    def test_cached_page_gets_fresh_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        url = self.post.get_absolute_url()
+        client.get(url)
+        # A new reader gets the cached page with a token matching its own cookie
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(url)
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'HIT')
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+        token = re.search(
+            r'name="csrfmiddlewaretoken" value="([^"]+)"',
+            response.content.decode()
+        )[1]
+        response = client.post(
+            reverse('blog:post_comment', args=[self.post.id]),
+            {'name': 'Jane', 'email': 'jane@example.com', 'body': 'Hi', 'csrfmiddlewaretoken': token}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_change_purges_its_pages(self):
+        detail_url = self.post.get_absolute_url()
+        tag_url = reverse('blog:post_list_by_tag', args=['cached'])
+        for url in [detail_url, tag_url, reverse('blog:post_list')]:
+            self.client.get(url)
+        self.post.title = 'Renamed Post'
+        self.post.save()
+        for url in [detail_url, tag_url, reverse('blog:post_list')]:
+            response = self.client.get(url)
+            self.assertEqual(response[CACHE_STATUS_HEADER], 'MISS')
+            self.assertContains(response, 'Renamed Post')
+
+    def test_unrelated_pages_stay_cached(self):
+        other = self.create_post('Other Post')
+        self.client.get(other.get_absolute_url())
+        Comment.objects.create(post=self.post, name='Jane', email='jane@example.com', body='Hi')
+        response = self.client.get(other.get_absolute_url())
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'HIT')
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'MISS')
+        self.assertContains(response, '1 comment')
+
+
+class ConditionalGetTests(QueryBudgetMixin, PostTestCase):
+
+    def setUp(self):
+        clear_feeds()
+        cache.clear()
+        caches['pages'].clear()
+        super().setUp()
+        self.post = self.create_post('Conditional Post')
+
+    def urls(self):
+        return [
+            reverse('blog:post_list'),
+            self.post.get_absolute_url(),
+            reverse('blog:post_feed'),
+            reverse('blog:django.contrib.sitemaps.views.sitemap'),
+        ]
+
+    def test_unchanged_resources_return_304(self):
+        for url in self.urls():
+            response = self.client.get(url)
+            self.assertTrue(response.has_header('ETag'))
+            self.assertTrue(response.has_header('Last-Modified'))
+            # Only the validator query runs, nothing is rendered
+            response = self.assertQueryBudget(
+                1, url, headers={'if-none-match': response['ETag']}
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            response = self.client.get(
+                url, headers={'if-modified-since': response['Last-Modified']}
+            )
+            self.assertEqual(response.status_code, 304)
+
+    def test_changed_resources_return_200(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls()}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = 'Edited Post'
+            self.post.save()
+        for url, etag in etags.items():
+            response = self.client.get(url, headers={'if-none-match': etag})
+            self.assertEqual(response.status_code, 200)
+
+    def test_comment_changes_pages_but_not_feed(self):
+        list_url = reverse('blog:post_list')
+        feed_url = reverse('blog:post_feed')
+        etags = {url: self.client.get(url)['ETag'] for url in [list_url, feed_url]}
+        Comment.objects.create(post=self.post, name='Jane', email='jane@example.com', body='Hi')
+        response = self.client.get(list_url, headers={'if-none-match': etags[list_url]})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(feed_url, headers={'if-none-match': etags[feed_url]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_deletes_return_200(self):
+        comment = Comment.objects.create(post=self.post, name='Jane', email='jane@example.com', body='Hi')
+        other = self.create_post('Deleted Post')
+        sitemap_url = reverse('blog:sitemap_section', kwargs={'section': 'posts', 'page': 1})
+        detail_url = self.post.get_absolute_url()
+        etags = {url: self.client.get(url)['ETag'] for url in [detail_url, sitemap_url]}
+        comment.delete()
+        response = self.client.get(detail_url, headers={'if-none-match': etags[detail_url]})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etags[detail_url])
+        other.delete()
+        response = self.client.get(sitemap_url, headers={'if-none-match': etags[sitemap_url]})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, other.get_absolute_url())
+
+    def test_detail_and_tag_pages_follow_their_posts(self):
+        self.post.tags.add('django')
+        other = self.create_post('Other Post')
+        other.tags.add('python')
+        detail_url = self.post.get_absolute_url()
+        tag_url = reverse('blog:post_list_by_tag', args=['django'])
+        etags = {url: self.client.get(url)['ETag'] for url in [detail_url, tag_url]}
+        # A comment on, or an edit of another post, changes neither page
+        Comment.objects.create(post=other, name='Jane', email='jane@example.com', body='Hi')
+        other.title = 'Edited Other Post'
+        other.save()
+        for url, etag in etags.items():
+            response = self.client.get(url, headers={'if-none-match': etag})
+            self.assertEqual(response.status_code, 304)
+        Comment.objects.create(post=self.post, name='Jane', email='jane@example.com', body='Hi')
+        response = self.client.get(detail_url, headers={'if-none-match': etags[detail_url]})
+        self.assertEqual(response.status_code, 200)
+        self.post.tags.remove('django')
+        response = self.client.get(tag_url, headers={'if-none-match': etags[tag_url]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_detail_page_returns_404(self):
+        response = self.client.get('/blog/2024/2/30/conditional-post/')
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncViewTests(PostTestCase):
+
+    def setUp(self):
+        clear_feeds()
+        cache.clear()
+        caches['pages'].clear()
+        self.factory = AsyncRequestFactory()
+        super().setUp()
+        self.post = self.create_post('Async Post')
+        self.post.tags.add('async')
+        self.other = self.create_post('Other Async Post')
+        self.other.tags.add('async')
+        Comment.objects.create(post=self.post, name='Jane', email='jane@example.com', body='Async comment')
+
+    def detail_args(self):
+        publish = self.post.publish
+        return publish.year, publish.month, publish.day, self.post.slug
+
+    async def test_post_list(self):
+        response = await async_views.post_list(self.factory.get('/blog/'))
+        self.assertContains(response, 'Other Async Post')
+        self.assertContains(response, 'I\'ve written 2 posts so far')
+        response = await async_views.post_list(self.factory.get('/blog/?page=9'), tag_slug='async')
+        self.assertContains(response, 'Posts tagged with "async"')
+        with self.assertRaises(Http404):
+            await async_views.post_list(self.factory.get('/blog/'), tag_slug='missing')
+
+    async def test_post_detail(self):
+        request = self.factory.get(self.post.get_absolute_url())
+        response = await async_views.post_detail(request, *self.detail_args())
+        self.assertContains(response, 'Async comment')
+        self.assertContains(response, self.other.get_absolute_url())
+        with self.assertRaises(Http404):
+            await async_views.post_detail(request, 2000, 1, 1, self.post.slug)
+
+    async def test_post_search_and_feed(self):
+        response = await async_views.post_search(self.factory.get('/blog/search/', {'query': 'another'}))
+        self.assertContains(response, 'Other Async Post')
+        response = await async_views.post_feed(self.factory.get('/blog/feed/'))
+        self.assertEqual(response['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertContains(response, '<title>Async Post</title>')
+
+    async def test_page_cache_and_conditional_get(self):
+        view = post_condition(page_cache(async_views.post_detail))
+        url = self.post.get_absolute_url()
+        response = await view(self.factory.get(url), *self.detail_args())
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'MISS')
+        response = await view(self.factory.get(url), *self.detail_args())
+        self.assertEqual(response[CACHE_STATUS_HEADER], 'HIT')
+        request = self.factory.get(url, headers={'if-none-match': response['ETag']})
+        response = await view(request, *self.detail_args())
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(BLOG_PAGE_CACHE_ENABLED=False)
+class RenderCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['template_fragments'].clear()
+        self.post = Post.objects.create(
+            title='Fragment Post',
+            slug='fragment-post',
+            body='Body.',
+            author=get_user_model().objects.create_user(username='author'),
+            status=Post.Status.PUBLISHED
+        )
+        self.post.tags.add('first')
+
+    def test_templates_loaded_once(self):
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIsInstance(loader, CachedLoader)
+
+    def test_listing_fragment_keyed_by_update_time(self):
+        url = reverse('blog:post_list')
+        self.assertContains(self.client.get(url), 'Fragment Post')
+        # A change that skips save() keeps the cached fragment
+        Post.objects.filter(pk=self.post.pk).update(title='Renamed Post')
+        self.assertContains(self.client.get(url), 'Fragment Post')
+        self.post.refresh_from_db()
+        self.post.save()
+        self.assertContains(self.client.get(url), 'Renamed Post')
+        # Tag changes touch the post too
+        self.post.tags.add('second')
+        self.assertContains(self.client.get(url), 'second')
+
+    def test_absolute_url_reversed_once(self):
+        post_url.cache_clear()
+        with patch('blog.models.reverse', wraps=reverse) as reversed_url:
+            first = self.post.get_absolute_url()
+            second = Post.objects.get(pk=self.post.pk).get_absolute_url()
+        self.assertEqual(first, second)
+        self.assertEqual(reversed_url.call_count, 1)
+
+
+@override_settings(BLOG_SITEMAP_LIMIT=2)
+class SitemapTests(PostTestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['pages'].clear()
+        super().setUp()
+        now = timezone.now()
+        self.posts = [
+            self.create_post(f'Sitemap Post {i}', publish=now - timezone.timedelta(days=10 - i))
+            for i in range(5)
+        ]
+
+    def section_url(self, page):
+        return reverse('blog:sitemap_section', kwargs={'section': 'posts', 'page': page})
+
+    def test_index_lists_child_pages(self):
+        response = self.client.get(reverse('blog:django.contrib.sitemaps.views.sitemap'))
+        self.assertEqual(response.status_code, 200)
+        for page in [1, 2, 3]:
+            self.assertContains(response, f'<loc>http://example.com{self.section_url(page)}</loc>')
+        self.assertNotContains(response, self.section_url(4))
+
+    def test_child_pages_list_posts_oldest_first(self):
+        for page, posts in [(1, self.posts[:2]), (2, self.posts[2:4]), (3, self.posts[4:])]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.section_url(page))
+            self.assertEqual(response['Content-Type'], 'application/xml; charset=utf-8')
+            self.assertEqual(response.content.decode().count('<url>'), len(posts))
+            for post in posts:
+                self.assertContains(response, f'<loc>http://example.com{post.get_absolute_url()}</loc>')
+            # The body is never loaded
+            self.assertFalse(any('"body"' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(self.client.get(self.section_url(4)).status_code, 404)
+        response = self.client.get(reverse('blog:sitemap_section', kwargs={'section': 'tags', 'page': 1}))
+        self.assertEqual(response.status_code, 404)
+
+    def assertCached(self, pages, cached):
+        for page in pages:
+            self.assertEqual(
+                self.client.get(self.section_url(page))[CACHE_STATUS_HEADER],
+                'HIT' if cached else 'MISS'
+            )
+
+    def test_edit_purges_only_its_page(self):
+        self.assertCached([1, 2, 3], cached=False)
+        self.posts[2].title = 'Edited Sitemap Post'
+        self.posts[2].save()
+        self.assertCached([1, 3], cached=True)
+        self.assertCached([2], cached=False)
+
+    def test_new_post_purges_only_last_page(self):
+        self.assertCached([1, 2, 3], cached=False)
+        self.create_post('New Sitemap Post')
+        self.assertCached([1, 2], cached=True)
+        self.assertCached([3], cached=False)
+        self.assertEqual(self.client.get(self.section_url(3)).content.decode().count('<url>'), 2)
+
+    def test_unpublish_purges_following_pages(self):
+        self.assertCached([1, 2, 3], cached=False)
+        post = Post.objects.get(pk=self.posts[2].pk)
+        post.status = Post.Status.DRAFT
+        post.save()
+        self.assertCached([1], cached=True)
+        self.assertCached([2], cached=False)
+        self.assertEqual(self.client.get(self.section_url(3)).status_code, 404)
+        self.posts[0].delete()
+        self.assertCached([1, 2], cached=False)
+
+
+class FeedTests(PostTestCase):
+
+    def setUp(self):
+        clear_feeds()
+        super().setUp()
+        self.post = self.create_post('Feed Post', body='This is a **feed** post.')
+        self.post.tags.add('feeds')
+
+    def test_feeds_served_without_queries(self):
+        feeds.build_feeds([feeds.LATEST, 'feeds'])
+        for name, args, content_type in [
+            ('blog:post_feed', [], 'application/rss+xml; charset=utf-8'),
+            ('blog:post_feed_atom', [], 'application/atom+xml; charset=utf-8'),
+            ('blog:post_feed_by_tag', ['feeds'], 'application/rss+xml; charset=utf-8'),
+            ('blog:post_feed_atom_by_tag', ['feeds'], 'application/atom+xml; charset=utf-8'),
+        ]:
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse(name, args=args))
+            self.assertEqual(response['Content-Type'], content_type)
+            self.assertContains(response, 'Feed Post')
+            # The stored excerpt, not the Markdown source
+            self.assertContains(response, '&lt;strong&gt;feed&lt;/strong&gt;')
+            response = self.client.get(
+                reverse(name, args=args),
+                headers={'if-none-match': response['ETag']}
+            )
+            self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(reverse('blog:post_feed_by_tag', args=['missing'])).status_code, 404)
+
+    def test_feeds_rebuilt_on_commit(self):
+        feeds.build_feeds([feeds.LATEST, 'feeds'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = 'Edited Feed Post'
+            self.post.save()
+        for url in [reverse('blog:post_feed_atom'), reverse('blog:post_feed_by_tag', args=['feeds'])]:
+            self.assertContains(self.client.get(url), 'Edited Feed Post')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.tags.remove('feeds')
+        self.assertNotContains(
+            self.client.get(reverse('blog:post_feed_by_tag', args=['feeds'])),
+            'Edited Feed Post'
+        )
+        # Only the feed files are left behind, no temporary files
+        self.assertEqual(
+            sorted(path.name for path in Path(settings.BLOG_FEED_ROOT).iterdir()),
+            ['latest.atom.xml', 'latest.rss.xml', 'tag-feeds.atom.xml', 'tag-feeds.rss.xml']
+        )
+
+    @override_settings(BLOG_FEED_DEBOUNCE=60)
+    def test_rebuilds_are_debounced(self):
+        draft = self.create_post('Draft Feed Post', status=Post.Status.DRAFT)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.save()
+            draft.save()
+            self.post.tags.add('more')
+        timer = feeds._timer
+        try:
+            # Drafts do not touch the feeds, every change is written at once
+            self.assertEqual(feeds._pending, {feeds.LATEST, 'feeds', 'more'})
+            self.assertTrue(timer.is_alive())
+        finally:
+            timer.cancel()
+            feeds._pending.clear()
+            feeds._timer = None
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        clear_feeds()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.publish = timezone.now() - timezone.timedelta(days=30)
+        for i in range(3):
+            post = Post.objects.create(
+                title=f'Archived Post {i}',
+                slug=f'archived-post-{i}',
+                body=f'This is **archived** post {i}.',
+                author=self.user,
+                status=Post.Status.PUBLISHED,
+                publish=self.publish
+            )
+            post.tags.add('archive', f'year{i}')
+            Comment.objects.create(post=post, name='Jane', email='jane@example.com', body=f'Comment {i}')
+            Comment.objects.create(post=post, name='Joe', email='joe@example.com', body='Hidden', active=False)
+
+    def export(self):
+        path = f'{self.dir}/blog.jsonl'
+        call_command('export_blog', path, batch_size=2, stdout=StringIO())
+        return path
+
+    def test_export_import_round_trip(self):
+        path = self.export()
+        expected = {
+            post.slug: (post.created, post.updated, sorted(post.tags.names()))
+            for post in Post.objects.all()
+        }
+        Post.objects.all().delete()
+        out = StringIO()
+        call_command('import_blog', path, batch_size=2, stdout=out)
+        self.assertIn('Imported 3 posts, 6 comments and 6 tag links (0 skipped)', out.getvalue())
+        self.assertIn('rows/sec', out.getvalue())
+        for post in Post.objects.all():
+            self.assertEqual(expected.pop(post.slug), (post.created, post.updated, sorted(post.tags.names())))
+            self.assertEqual(post.publish, self.publish)
+            self.assertEqual(post.author, self.user)
+            self.assertIn('<strong>archived</strong>', post.body_html)
+            self.assertEqual(post.active_comment_count, 1)
+            self.assertEqual(post.comments.count(), 2)
+        self.assertEqual(expected, {})
+        self.assertEqual(Tag.objects.filter(name='archive').count(), 1)
+        self.assertEqual(Post.published.filter(search_vector='archived').count(), 3)
+        # Derived data is rebuilt after the import
+        self.assertEqual(SimilarPost.objects.count(), 6)
+        self.assertFalse(Path(f'{path}.checkpoint').exists())
+
+    def test_import_changes_validators(self):
+        path = self.export()
+        urls = [reverse('blog:post_list'), reverse('blog:django.contrib.sitemaps.views.sitemap')]
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        # Imported as new posts, with the old timestamps of the archive
+        call_command('import_blog', path, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 6)
+        for url, etag in etags.items():
+            response = self.client.get(url, headers={'if-none-match': etag})
+            self.assertEqual(response.status_code, 200)
+
+    def test_export_without_server_side_cursors(self):
+        records = list(export_records(batch_size=2))
+        with patch.dict(connection.settings_dict, {'DISABLE_SERVER_SIDE_CURSORS': True}):
+            self.assertEqual(list(export_records(batch_size=2)), records)
+        self.assertEqual(len(records), 3)
+
+    def test_slug_collisions(self):
+        path = self.export()
+        call_command('import_blog', path, on_conflict='skip', stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 3)
+        call_command('import_blog', path, stdout=StringIO())
+        self.assertEqual(
+            sorted(Post.objects.values_list('slug', flat=True)),
+            [
+                'archived-post-0', 'archived-post-0-2', 'archived-post-1',
+                'archived-post-1-2', 'archived-post-2', 'archived-post-2-2'
+            ]
+        )
+        # Other dates do not collide
+        Post.objects.update(publish=self.publish - timezone.timedelta(days=1))
+        call_command('import_blog', path, stdout=StringIO())
+        self.assertEqual(Post.objects.filter(slug='archived-post-0').count(), 2)
+
+    def test_import_resumes_from_checkpoint(self):
+        path = self.export()
+        Post.objects.all().delete()
+        with open(f'{path}.checkpoint', 'w') as checkpoint:
+            checkpoint.write('2')
+        out = StringIO()
+        call_command('import_blog', path, stdout=out)
+        self.assertIn('Resuming after line 2', out.getvalue())
+        self.assertEqual(list(Post.objects.values_list('slug', flat=True)), ['archived-post-2'])
+
+    def test_invalid_record_keeps_checkpoint(self):
+        path = self.export()
+        with open(path, 'a') as archive:
+            archive.write('{"title": "Broken"}\n')
+        Post.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('import_blog', path, batch_size=3, stdout=StringIO())
+        with open(f'{path}.checkpoint') as checkpoint:
+            self.assertEqual(checkpoint.read(), '3')
+        self.assertEqual(Post.objects.count(), 3)
+
+
+class SeedCorpusTests(TestCase):
+
+    def setUp(self):
+        clear_feeds()
+
+    def test_seed_blog(self):
+        call_command('seed_blog', posts=40, tags=10, comments=200, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(Comment.objects.count(), 200)
+        # Zipf distributed: the most used tag and the most commented post
+        # stand far above the average
+        tag_uses = sorted(
+            (Post.objects.filter(tags__name=tag.name).count() for tag in Tag.objects.all()),
+            reverse=True
+        )
+        self.assertGreater(tag_uses[0], 3 * tag_uses[-1])
+        comment_counts = sorted(Post.objects.values_list('active_comment_count', flat=True), reverse=True)
+        self.assertGreater(comment_counts[0], 4 * 200 / 40)
+
+
+@override_settings(BLOG_METRICS_SAMPLE_RATE=1, BLOG_PAGE_CACHE_ENABLED=False)
+class MetricsTests(PostTestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+        super().setUp()
+        self.post = self.create_post('Measured Post', body='This is a *measured* post.')
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.post.get_absolute_url())
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(captured)} queries"', timing)
+        for name in ['total', 'db', 'template', 'markdown']:
+            self.assertIn(f'{name};dur=', timing)
+        self.assertNotIn('template;dur=0.0,', timing)
+
+    @override_settings(BLOG_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_measured(self):
+        response = self.client.get(reverse('blog:post_list'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertNotIn('view="blog:post_list"', render_metrics())
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('blog:post_list'))
+        self.client.get(reverse('blog:post_list'))
+        response = self.client.get(reverse('blog:metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        content = response.content.decode()
+        self.assertIn('# TYPE blog_request_duration_seconds histogram', content)
+        self.assertIn('blog_request_duration_seconds_count{view="blog:post_list"} 2', content)
+        self.assertIn('blog_db_queries_bucket{view="blog:post_list",le="+Inf"} 2', content)
+        response = self.client.get(reverse('blog:metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    async def test_async_requests(self):
+        async def view(request):
+            return HttpResponse(str(await Post.objects.acount()))
+
+        middleware = MetricsMiddleware(view)
+        response = await middleware(AsyncRequestFactory().get('/'))
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertIn('blog_request_duration_seconds_count{view="unresolved"} 1', render_metrics())
+
+
+@override_settings(BLOG_REPLICAS=['replica'])
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        routers._unavailable.clear()
+        self.replica = Mock()
+        patcher = patch(
+            'blog.routers.connections',
+            {'default': Mock(in_atomic_block=False), 'replica': self.replica}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = routers.ReplicaRouter()
+        self.middleware = ReplicaMiddleware(lambda request: HttpResponse(routers.read_alias()))
+        self.factory = RequestFactory()
+
+    def test_content_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Post), 'replica')
+        self.assertEqual(self.router.db_for_read(Tag), 'replica')
+        self.assertEqual(self.router.db_for_read(OutboundEmail), 'default')
+        self.assertEqual(self.router.db_for_read(get_user_model()), 'default')
+        self.assertEqual(self.middleware(self.factory.get('/')).content, b'replica')
+
+    def test_writes_go_to_primary_and_pin_reads(self):
+        post = Post(title='Replica Post')
+        post._state.db = 'replica'
+        self.assertEqual(self.router.db_for_write(Post, instance=post), 'default')
+        # Caches purged by the write are filled from the primary
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        cache.clear()
+        self.assertEqual(self.router.db_for_read(Post), 'replica')
+
+    def test_reader_pinned_after_post(self):
+        response = self.middleware(self.factory.post('/'))
+        self.assertEqual(response.content, b'default')
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 5)
+        self.factory.cookies[routers.PIN_COOKIE] = '1'
+        self.assertEqual(self.middleware(self.factory.get('/')).content, b'default')
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        self.replica.ensure_connection.side_effect = OperationalError
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        # Not retried before BLOG_REPLICA_RETRY_SECONDS
+        self.assertEqual(self.replica.ensure_connection.call_count, 1)
+        self.replica.ensure_connection.side_effect = None
+        routers._unavailable['replica'] -= 30
+        self.assertEqual(self.router.db_for_read(Post), 'replica')
+
+
+class LoggingTests(TestCase):
+
+    def setUp(self):
+        self.stream = StringIO()
+        sink = logging.getLogger('blog.tests.sink')
+        sink.propagate = False
+        writer = logging.StreamHandler(self.stream)
+        writer.setFormatter(JsonFormatter())
+        sink.addHandler(writer)
+        self.addCleanup(sink.removeHandler, writer)
+
+    def test_records_written_as_json_lines_by_listener(self):
+        handler = QueueHandler(sink='blog.tests.sink')
+        logger = logging.getLogger('blog.tests.queued')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        logger.warning('Post %s saved', 'one', extra={'post_id': 1})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception('Failed')
+        handler.stop()
+        first, second = map(json.loads, self.stream.getvalue().splitlines())
+        self.assertEqual(first['message'], 'Post one saved')
+        self.assertEqual(first['level'], 'WARNING')
+        self.assertEqual(first['post_id'], 1)
+        self.assertIn('ZeroDivisionError', second['exc'])
+
+    def test_full_queue_drops_records(self):
+        handler = QueueHandler(sink='blog.tests.sink', maxsize=1)
+        record = logging.makeLogRecord({'msg': 'queued'})
+        handler.enqueue(record)
+        handler.enqueue(record)
+        self.assertEqual(handler.dropped, 1)
+
+    def test_production_profile(self):
+        config = logging_config(
+            'production', 'blog.log', levels=['django.request=error', 'blog=DEBUG']
+        )
+        self.assertEqual(config['loggers']['django.db.backends']['level'], 'WARNING')
+        self.assertEqual(config['loggers']['django.request']['level'], 'ERROR')
+        self.assertEqual(config['loggers']['blog']['level'], 'DEBUG')
+        self.assertEqual(config['handlers']['file']['formatter'], 'json')
+
+
+@override_settings(
+    BLOG_COMMENT_WRITE_BEHIND=True,
+    # Flushed by the tests, never by the flusher thread
+    BLOG_COMMENT_FLUSH_INTERVAL=3600,
+    BLOG_COMMENT_BATCH_SIZE=100,
+    BLOG_COMMENT_QUEUE_MAX=4,
+    BLOG_RATELIMIT_ENABLED=False,
+)
+class CommentQueueTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        commentqueue.flush()
+        self.addCleanup(commentqueue.flush)
+        user = get_user_model().objects.create_user(username='author')
+        self.posts = [
+            Post.objects.create(
+                title=f'Queued Post {i}',
+                slug=f'queued-post-{i}',
+                body='Body.',
+                author=user,
+                status=Post.Status.PUBLISHED
+            )
+            for i in range(2)
+        ]
+
+    def comment(self, post, body='Queued comment'):
+        return self.client.post(
+            reverse('blog:post_comment', args=[post.id]),
+            {'name': 'Reader', 'email': 'reader@example.com', 'body': body}
+        )
+
+    def test_comment_rendered_before_insert(self):
+        response = self.comment(self.posts[0])
+        self.assertContains(response, 'Your comment has been added.')
+        self.assertEqual(Comment.objects.count(), 0)
+        self.assertEqual(commentqueue.pending(), 1)
+
+    def test_flush_inserts_batch_and_updates_counters(self):
+        post = self.posts[0]
+        # The thread is cached before the flush
+        self.client.get(post.get_absolute_url())
+        for post in [self.posts[0], self.posts[0], self.posts[1]]:
+            self.comment(post)
+        self.assertEqual(commentqueue.flush(), 3)
+        self.assertEqual(commentqueue.pending(), 0)
+        self.assertEqual(Comment.objects.count(), 3)
+        counts = dict(Post.objects.values_list('slug', 'active_comment_count'))
+        self.assertEqual(counts, {'queued-post-0': 2, 'queued-post-1': 1})
+        response = self.client.get(self.posts[0].get_absolute_url())
+        self.assertContains(response, 'Queued comment', count=2)
+
+    def test_full_queue_flushed_by_request(self):
+        for i in range(4):
+            self.comment(self.posts[0], body=f'Comment {i}')
+        self.assertEqual(commentqueue.pending(), 0)
+        self.assertEqual(Comment.objects.count(), 4)
+
+    def test_batch_size_wakes_flusher(self):
+        with override_settings(BLOG_COMMENT_BATCH_SIZE=2):
+            # Starts the flusher thread, waiting on the real event
+            self.comment(self.posts[0])
+            with patch('blog.commentqueue._wakeup') as wakeup:
+                self.comment(self.posts[0])
+            wakeup.set.assert_called_once()
+
+    def test_failing_comment_dropped_alone(self):
+        self.comment(self.posts[0])
+        # Too long for the name column, fails the batch insert
+        commentqueue.enqueue(Comment(post=self.posts[1], name='x' * 200, email='a@example.com', body='Bad'))
+        self.comment(self.posts[1])
+        with self.assertLogs('blog.commentqueue', 'ERROR'):
+            self.assertEqual(commentqueue.flush(), 2)
+        self.assertEqual(Comment.objects.count(), 2)
+        self.assertEqual(Post.objects.get(pk=self.posts[1].pk).active_comment_count, 1)
+
+    @override_settings(BLOG_COMMENT_WRITE_BEHIND=False)
+    def test_disabled_saves_immediately(self):
+        self.comment(self.posts[0])
+        self.assertEqual(commentqueue.pending(), 0)
+        self.assertEqual(Comment.objects.count(), 1)
+
+
+@override_settings(BLOG_RATELIMITS={'post_comment': ['ip:5/m', 'email:3/h']})
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        ratelimit.reset()
+        self.addCleanup(ratelimit.reset)
+        user = get_user_model().objects.create_user(username='author')
+        self.post = Post.objects.create(
+            title='Limited Post',
+            slug='limited-post',
+            body='Body.',
+            author=user,
+            status=Post.Status.PUBLISHED
+        )
+        self.url = reverse('blog:post_comment', args=[self.post.id])
+
+    def comment(self, email='bot@example.com', ip='203.0.113.7'):
+        return self.client.post(
+            self.url,
+            {'name': 'Bot', 'email': email, 'body': 'Spam'},
+            REMOTE_ADDR=ip
+        )
+
+    def test_ip_burst(self):
+        statuses = [
+            self.comment(email=f'bot{i}@example.com').status_code for i in range(8)
+        ]
+        self.assertEqual(statuses, [200] * 5 + [429] * 3)
+        self.assertEqual(Comment.objects.count(), 5)
+        # Rejected before the form and the database
+        with self.assertNumQueries(0):
+            response = self.comment(email='bot9@example.com')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        # Other clients still get through
+        self.assertEqual(self.comment(email='reader@example.com', ip='198.51.100.1').status_code, 200)
+
+    def test_email_burst_from_many_ips(self):
+        statuses = [
+            self.comment(email='Bot@Example.com ', ip=f'203.0.113.{i}').status_code
+            for i in range(5)
+        ]
+        self.assertEqual(statuses, [200] * 3 + [429] * 2)
+
+    def test_ipv6_clients_share_their_network(self):
+        statuses = [
+            self.comment(email=f'bot{i}@example.com', ip=f'2001:db8::{i}').status_code
+            for i in range(6)
+        ]
+        self.assertEqual(statuses[-1], 429)
+
+    def test_window_shared_between_processes(self):
+        for i in range(5):
+            self.comment(email=f'bot{i}@example.com')
+        # A fresh process has full buckets, the cached window still holds
+        ratelimit.reset()
+        self.assertEqual(self.comment(email='bot5@example.com').status_code, 429)
+
+    def test_empty_bucket_skips_cache(self):
+        for i in range(5):
+            self.comment(email=f'bot{i}@example.com')
+        with patch('blog.ratelimit.hit_window') as hit_window:
+            self.assertEqual(self.comment(email='bot5@example.com').status_code, 429)
+        hit_window.assert_not_called()
+
+    def test_limit_recovers_over_time(self):
+        with patch('blog.ratelimit.time') as clock:
+            clock.time.return_value = clock.monotonic.return_value = 60000.0
+            for i in range(6):
+                self.comment(email=f'bot{i}@example.com')
+            self.assertEqual(self.comment(email='bot6@example.com').status_code, 429)
+            # Two minutes later both the bucket and the window are free again
+            clock.time.return_value = clock.monotonic.return_value = 60120.0
+            self.assertEqual(self.comment(email='bot7@example.com').status_code, 200)
+
+    @override_settings(BLOG_RATELIMIT_ENABLED=False)
+    def test_disabled(self):
+        statuses = {self.comment(email=f'bot{i}@example.com').status_code for i in range(8)}
+        self.assertEqual(statuses, {200})
+
+    def test_invalid_rule(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ratelimit.parse_rule('ip:5 per minute')
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('SMTP server unavailable')
+
+
+class FlakyEmailBackend(BaseEmailBackend):
+    # Fails its first message, logs when it is opened, used and closed
+    log = []
+
+    def open(self):
+        if not getattr(self, 'opened', False):
+            self.opened = True
+            self.log.append('open')
+            return True
+
+    def close(self):
+        if getattr(self, 'opened', False):
+            self.opened = False
+            self.log.append('close')
+
+    def send_messages(self, email_messages):
+        opened = self.open()
+        self.log.append('send')
+        try:
+            if self.log.count('send') == 1:
+                raise ConnectionResetError('Connection reset by peer')
+        finally:
+            if opened:
+                self.close()
+        return len(email_messages)
+
+
+class OutboxTests(TestCase):
+
+    def send_outbox(self):
+        call_command('send_outbox', stdout=StringIO())
+
+    def test_outbox_sends_in_batches(self):
+        for i in range(5):
+            queue_mail(f'Subject {i}', 'Message', f'friend{i}@example.com')
+        call_command('send_outbox', batch_size=2, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(
+            OutboundEmail.objects.filter(status=OutboundEmail.Status.SENT).count(),
+            5
+        )
+
+    @override_settings(
+        EMAIL_BACKEND='blog.tests.FailingEmailBackend',
+        BLOG_OUTBOX_MAX_ATTEMPTS=2
+    )
+    def test_failed_email_retried_then_dead_lettered(self):
+        email = queue_mail('Subject', 'Message', 'friend@example.com')
+        self.send_outbox()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.Status.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('SMTP server unavailable', email.last_error)
+        self.assertGreater(email.next_attempt, timezone.now())
+
+        # Not due yet
+        self.send_outbox()
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+
+        OutboundEmail.objects.update(next_attempt=timezone.now())
+        self.send_outbox()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.Status.DEAD)
+        self.assertEqual(email.attempts, 2)
+
+    @override_settings(EMAIL_BACKEND='blog.tests.FlakyEmailBackend')
+    def test_connection_reopened_once_after_failure(self):
+        FlakyEmailBackend.log = []
+        for i in range(4):
+            queue_mail(f'Subject {i}', 'Message', f'friend{i}@example.com')
+        self.send_outbox()
+        self.assertEqual(
+            FlakyEmailBackend.log,
+            ['open', 'send', 'close', 'open', 'send', 'send', 'send', 'close']
+        )
+        self.assertEqual(
+            OutboundEmail.objects.filter(status=OutboundEmail.Status.SENT).count(),
+            3
+        )
+
+    @override_settings(BLOG_OUTBOX_DOMAIN_RATE=2)
+    def test_outbox_rate_limited_per_domain(self):
+        for i in range(3):
+            queue_mail('Subject', 'Message', f'friend{i}@example.com')
+        queue_mail('Subject', 'Message', 'friend@example.org')
+        self.send_outbox()
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ['friend0@example.com', 'friend1@example.com', 'friend@example.org']
+        )
+        postponed = OutboundEmail.objects.get(status=OutboundEmail.Status.PENDING)
+        self.assertEqual(postponed.attempts, 0)
+        self.assertGreater(postponed.next_attempt, timezone.now())
@@ -1,42 +1,67 @@
+from django.conf import settings
 from django.urls import path
-from . import views
-from django.contrib.sitemaps.views import sitemap
+from . import async_views, views
 from .sitemaps import PostSitemap
-from .feeds import LatestPostsFeed
+from .pagecache import page_cache
+from .ratelimit import ratelimit
+from .conditional import content_condition, post_condition, posts_condition, tag_condition
 
 app_name = 'blog'
 
+# Read-only pages, served by the async views under ASGI
+read_views = async_views if settings.BLOG_ASYNC_VIEWS else views
+
 sitemaps = {
     'posts': PostSitemap
 }
 
 urlpatterns = [
-    path('', views.post_list, name='post_list'),
+    path('', content_condition(page_cache(read_views.post_list)), name='post_list'),
     path(
         '<int:year>/<int:month>/<int:day>/<slug:post>/',
-        views.post_detail,
+        post_condition(page_cache(read_views.post_detail)),
         name='post_detail'
     ),
     path(
         '<int:post_id>/share/',
-        views.post_share,
+        ratelimit(views.post_share),
         name='post_share'
     ),
     path(
         '<int:post_id>/comment/', 
-        views.post_comment, 
+        ratelimit(views.post_comment),
         name='post_comment'),
     path(
         'tag/<slug:tag_slug>/', 
-        views.post_list, 
+        tag_condition(page_cache(read_views.post_list)),
         name='post_list_by_tag'
         ),
     path(
         'sitemap.xml',
-        sitemap,
+        posts_condition(page_cache(views.sitemap_index)),
         {'sitemaps': sitemaps},
         name='django.contrib.sitemaps.views.sitemap'
     ),
-    path('feed/', LatestPostsFeed(), name='post_feed'),
-    path('search/', views.post_search, name='post_search'),
+    path(
+        'sitemap-<str:section>-<int:page>.xml',
+        posts_condition(page_cache(views.sitemap_section)),
+        {'sitemaps': sitemaps},
+        name='sitemap_section'
+    ),
+    # Feeds are static files carrying their own validators
+    path('feed/', read_views.post_feed, name='post_feed'),
+    path('feed/atom/', read_views.post_feed, {'kind': 'atom'}, name='post_feed_atom'),
+    path(
+        'tag/<slug:tag_slug>/feed/',
+        read_views.post_feed,
+        name='post_feed_by_tag'
+    ),
+    path(
+        'tag/<slug:tag_slug>/feed/atom/',
+        read_views.post_feed,
+        {'kind': 'atom'},
+        name='post_feed_atom_by_tag'
+    ),
+    path('search/', read_views.post_search, name='post_search'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
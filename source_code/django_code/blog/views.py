@@ -1,12 +1,17 @@
 # Post list
 from taggit.models import Tag
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from .models import Post
+from django.http import Http404
+from .models import POST_LINK_FIELDS, Post, publish_day_lookup
+from .pagination import CursorPaginator, InvalidCursor
+from .comments import PAGE_PARAM as COMMENTS_PAGE_PARAM, comment_page, comment_thread
+from . import commentqueue
 
 def post_list(request, tag_slug=None):
-    # Get all published posts
-    post_list = Post.published.all()
+    # Get all published posts with their authors and tags, without bodies
+    post_list = Post.published.for_listing().prefetch_related('tags')
     tag = None
 
     # If a tag_slug is provided, filter posts by that tag
@@ -14,57 +19,67 @@ def post_list(request, tag_slug=None):
         tag = get_object_or_404(Tag, slug=tag_slug)
         post_list = post_list.filter(tags__in=[tag])
 
-    # Pagination with 3 posts per page
-    paginator = Paginator(post_list, 3)
-    page_number = request.GET.get('page', 1)
+    if settings.BLOG_PAGINATION == 'cursor':
+        # Keyset pagination with 3 posts per page, no COUNT and no OFFSET
+        paginator = CursorPaginator(post_list, 3)
+        try:
+            posts = paginator.page(request.GET.get('cursor'))
+        except InvalidCursor:
+            # If the cursor is malformed, get the first page
+            posts = paginator.page()
+        pagination_template = 'cursor_pagination.html'
+    else:
+        # Pagination with 3 posts per page
+        paginator = Paginator(post_list, 3)
+        page_number = request.GET.get('page', 1)
 
-    try:
-        posts = paginator.page(page_number)
-    except PageNotAnInteger:
-        # If page_number is not an integer, get the first page
-        posts = paginator.page(1)
-    except EmptyPage:
-        # If page_number is out of range, get the last page of results
-        posts = paginator.page(paginator.num_pages)
+        try:
+            posts = paginator.page(page_number)
+        except PageNotAnInteger:
+            # If page_number is not an integer, get the first page
+            posts = paginator.page(1)
+        except EmptyPage:
+            # If page_number is out of range, get the last page of results
+            posts = paginator.page(paginator.num_pages)
+        pagination_template = 'pagination.html'
 
     return render(
         request,
         'blog/post/list.html',
         {
             'posts': posts,
-            'tag': tag  # Pass the tag to the template
+            'tag': tag,  # Pass the tag to the template
+            'pagination_template': pagination_template
         }
     )
 
 # Post details
-from django.db.models import Count
-
 def post_detail(request, year, month, day, post):
+    try:
+        lookup = publish_day_lookup(year, month, day)
+    except ValueError:
+        raise Http404('No such date')
     post = get_object_or_404(
-        Post,
-        status=Post.Status.PUBLISHED,
+        Post.published.select_related('author'),
         slug=post,
-        publish__year=year,
-        publish__month=month,
-        publish__day=day
+        **lookup
     )
     
-    # List of active comments for this post
-    comments = post.comments.filter(active=True)
+    # Page of active comments for this post, rendered once per change
+    page = comment_page(post, request.GET.get(COMMENTS_PAGE_PARAM, 1))
+    comments = comment_thread(post, page)
     
     # Form for users to comment
     form = CommentForm()
     
-    # List of similar posts
-    post_tags_ids = post.tags.values_list('id', flat=True)  # Get all tag IDs for the current post
-    similar_posts = Post.published.filter(
-        tags__in=post_tags_ids  # Filter posts that share tags with the current post
-    ).exclude(id=post.id)  # Exclude the current post itself
-    
-    # Annotate similar posts with a count of shared tags
-    similar_posts = similar_posts.annotate(
-        same_tags=Count('tags')  # Count the shared tags for each post
-    ).order_by('-same_tags', '-publish')[:4]  # Order by shared tag count and publish date, limit to 4 posts
+    # List of similar posts, precomputed from shared tags (see blog.similar).
+    # The entries keep their post, or it is fetched again for every entry.
+    similar_posts = [
+        entry.similar_post
+        for entry in post.similar_entries.select_related('similar_post').only(
+            'post', *[f'similar_post__{field}' for field in POST_LINK_FIELDS]
+        )
+    ]
     
     return render(
         request,
@@ -72,6 +87,7 @@ def post_detail(request, year, month, day, post):
         {
             'post': post,
             'comments': comments,
+            'comment_page': page,
             'form': form,
             'similar_posts': similar_posts  # Pass similar posts to the template
         }
@@ -80,9 +96,9 @@ def post_detail(request, year, month, day, post):
 
 # Email post sharing views
 from django.shortcuts import render, get_object_or_404
-from django.core.mail import send_mail
 from .models import Post
 from .forms import EmailPostForm
+from .outbox import queue_mail
 
 def post_share(request, post_id):
     # Retrieve post by id
@@ -101,11 +117,11 @@ def post_share(request, post_id):
             post_url = request.build_absolute_uri(post.get_absolute_url())
             subject = f"{cd['name']} ({cd['email']}) recommends you read {post.title}"
             message = f"Read {post.title} at {post_url}\n\n{cd['name']}'s comments: {cd['comments']}"
-            send_mail(
+            # Queued in the outbox, sent by the `send_outbox` worker
+            queue_mail(
                 subject=subject,
                 message=message,
-                from_email=None,
-                recipient_list=[cd['to']]
+                to=cd['to']
             )
             sent = True
     else:
@@ -127,8 +143,10 @@ from .forms import CommentForm
 
 @require_POST
 def post_comment(request, post_id):
+    write_behind = settings.BLOG_COMMENT_WRITE_BEHIND
     post = get_object_or_404(
-        Post,
+        # Queued comments only need the URL of their post
+        Post.published.for_links() if write_behind else Post,
         id=post_id,
         status=Post.Status.PUBLISHED
     )
@@ -140,8 +158,12 @@ def post_comment(request, post_id):
         comment = form.save(commit=False)
         # Assign the post to the comment
         comment.post = post
-        # Save the comment to the database
-        comment.save()
+        if write_behind:
+            # Inserted with the next batch (see blog.commentqueue)
+            commentqueue.enqueue(comment)
+        else:
+            # Save the comment to the database
+            comment.save()
     return render(
         request,
         'blog/post/comment.html',
@@ -154,12 +176,11 @@ def post_comment(request, post_id):
 
 # Search view
 from django.contrib.postgres.search import (
-    SearchVector,
     SearchQuery,
     SearchRank
 )
+from django.db.models import F
 from .forms import SearchForm
-from django.contrib.postgres.search import TrigramSimilarity
 
 def post_search(request):
     form = SearchForm()
@@ -170,14 +191,25 @@ def post_search(request):
         form = SearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['query']
-            results = (
-                Post.published.annotate(
-                    similarity=TrigramSimilarity('title', query),
-                )
-                .filter(similarity__gt=0.1)
-                .order_by('-similarity')
+            posts = Post.published.for_listing()
+            limit = settings.BLOG_SEARCH_LIMIT
+
+            # Full-text search on the stored, GIN-indexed search vector
+            search_query = SearchQuery(
+                query,
+                config=settings.BLOG_SEARCH_CONFIG,
+                search_type='websearch'
+            )
+            results = list(
+                posts.filter(search_vector=search_query)
+                .annotate(rank=SearchRank(F('search_vector'), search_query))
+                .order_by('-rank', '-publish')[:limit]
             )
 
+            # Fall back to typo-tolerant title matching on the trigram index
+            if not results:
+                results = posts.title_matches(query, limit)
+
     return render(
         request,
         'blog/post/search.html',
@@ -186,4 +218,72 @@ def post_search(request):
             'query': query,
             'results': results
         },
-    )
\ No newline at end of file
+    )
+
+# Sitemap views
+from django.contrib.sites.shortcuts import get_current_site
+from django.contrib.sitemaps.views import SitemapIndexItem, x_robots_tag
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponse
+from django.template.response import TemplateResponse
+from django.urls import reverse
+
+def get_sitemap(sitemaps, section):
+    if section not in sitemaps:
+        raise Http404(f'No sitemap available for section: {section!r}')
+    site_map = sitemaps[section]
+    return site_map() if callable(site_map) else site_map
+
+@x_robots_tag
+def sitemap_index(request, sitemaps):
+    # One entry per child page of every section
+    domain = get_current_site(request).domain
+    entries = []
+    for section in sitemaps:
+        site_map = get_sitemap(sitemaps, section)
+        protocol = site_map.get_protocol(request.scheme)
+        for page, lastmod in site_map.page_lastmods():
+            location = reverse('blog:sitemap_section', kwargs={'section': section, 'page': page})
+            entries.append(SitemapIndexItem(f'{protocol}://{domain}{location}', lastmod))
+    return TemplateResponse(
+        request,
+        'sitemap_index.xml',
+        {'sitemaps': entries},
+        content_type='application/xml'
+    )
+
+@x_robots_tag
+def sitemap_section(request, sitemaps, section, page):
+    site_map = get_sitemap(sitemaps, section)
+    protocol = site_map.get_protocol(request.scheme)
+    domain = site_map.get_domain(get_current_site(request))
+    # Written while the posts are read, the response holds one page at most
+    response = HttpResponse(content_type='application/xml; charset=utf-8')
+    try:
+        site_map.write_page(response, page, protocol, domain)
+    except InvalidPage:
+        raise Http404(f'Page {page} empty')
+    return response
+
+
+# Feed views, serving the pre-generated feed files (see blog.feeds)
+from .feeds import LATEST, ensure_feed, feed_response
+
+def post_feed(request, kind='rss', tag_slug=LATEST):
+    return feed_response(request, ensure_feed(kind, tag_slug), kind)
+
+# Metrics view, histograms of the sampled requests in the Prometheus text format
+from django.core.exceptions import PermissionDenied
+from .metrics import render_metrics
+
+def metrics(request):
+    # Only for scrapers on INTERNAL_IPS and staff users
+    if (
+        request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS
+        and not request.user.is_staff
+    ):
+        raise PermissionDenied
+    return HttpResponse(
+        render_metrics(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+# Native async views avoid a thread-pool hop per request under ASGI
+os.environ.setdefault('BLOG_ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
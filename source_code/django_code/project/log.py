@@ -0,0 +1,181 @@
+# Logging profiles. Loggers hand their records to a bounded in-memory
+# queue and a background thread writes them out, so request handling
+# never waits on log I/O.
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from pathlib import Path
+
+# Logger whose handlers write the records taken off the queue
+SINK = 'project.log.sink'
+
+# Attributes of every LogRecord, anything else was passed in `extra`
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line, with the plain values passed in `extra`
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS and isinstance(value, (str, int, float, bool, type(None))):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    # Queue records for a listener thread that passes them to the handlers
+    # of the `sink` logger. When the queue is full records are dropped and
+    # counted instead of blocking the caller.
+
+    def __init__(self, sink=SINK, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.sink = sink
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+        self.start_lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def start(self):
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            # Started lazily, and again in a forked worker, which
+            # inherits the queue but not the listener thread
+            self.queue = queue.Queue(self.queue.maxsize)
+            self.listener = QueueListener(
+                self.queue,
+                *logging.getLogger(self.sink).handlers,
+                respect_handler_level=True
+            )
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def stop(self):
+        # Write out the queued records
+        with self.start_lock:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+            self.pid = None
+
+    def prepare(self, record):
+        # Merge the arguments and render the traceback now, the listener
+        # thread formats the record later
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        super().emit(record)
+
+    def close(self):
+        self.stop()
+        super().close()
+
+
+def file_handler(filename, max_bytes=0, backup_count=0, when=''):
+    # Rotate by time when `when` is set (see TimedRotatingFileHandler),
+    # by size otherwise
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    if when:
+        return TimedRotatingFileHandler(
+            filename, when=when, backupCount=backup_count, delay=True, utc=True
+        )
+    return RotatingFileHandler(
+        filename, maxBytes=max_bytes, backupCount=backup_count, delay=True
+    )
+
+
+def logging_config(
+    profile,
+    filename,
+    level='INFO',
+    levels=(),
+    max_bytes=10 * 1024 * 1024,
+    backup_count=5,
+    when='',
+    queue_size=10000,
+):
+    # LOGGING for a profile:
+    #  - development: plain text to `filename` at DEBUG, SQL included
+    #  - production: JSON lines to `filename` at `level`, no SQL
+    # `levels` overrides the level of single loggers ('logger=LEVEL').
+    development = profile == 'development'
+    config = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'text': {
+                'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+            },
+            'json': {
+                '()': JsonFormatter,
+            },
+        },
+        'handlers': {
+            'queue': {
+                '()': QueueHandler,
+                'maxsize': queue_size,
+            },
+            'file': {
+                '()': file_handler,
+                'filename': filename,
+                'max_bytes': max_bytes,
+                'backup_count': backup_count,
+                'when': when,
+                'formatter': 'text' if development else 'json',
+            },
+        },
+        'loggers': {
+            SINK: {
+                'handlers': ['file'],
+                'level': 'DEBUG',
+                'propagate': False,
+            },
+            'django': {
+                'level': 'DEBUG' if development else level,
+            },
+            'django.db.backends': {
+                'level': 'DEBUG' if development else 'WARNING',
+            },
+        },
+        'root': {
+            'handlers': ['queue'],
+            'level': 'DEBUG' if development else level,
+        },
+    }
+    for override in levels:
+        name, _, logger_level = override.partition('=')
+        config['loggers'].setdefault(name.strip(), {})['level'] = logger_level.strip().upper()
+    return config
@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config # Configuration file manager
+from decouple import config, Csv # Configuration file manager
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -28,6 +29,9 @@ DEBUG = config('DEBUG', default=True, cast=bool)
 
 ALLOWED_HOSTS = []
 
+# Addresses allowed to scrape the metrics endpoint
+INTERNAL_IPS = config('INTERNAL_IPS', default='127.0.0.1', cast=Csv())
+
 
 # Application definition
 
@@ -48,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.middleware.MetricsMiddleware',
+    'blog.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,8 +69,15 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Templates are read and compiled once per process, the
+            # development server's autoreloader clears them on changes
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -89,9 +102,60 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT', default= '5432', cast=int),
+        # Behind a transaction-pooling proxy (PgBouncer) server-side
+        # cursors must be disabled, exports then read keyset batches
+        'DISABLE_SERVER_SIDE_CURSORS': config('DB_DISABLE_SERVER_SIDE_CURSORS', default=False, cast=bool),
     }
 }
 
+# Database connection strategy:
+# - 'none': a new connection per request
+# - 'persistent': connections kept open for DB_CONN_MAX_AGE seconds (None
+#   for no limit) and checked before reuse; under WSGI only, async views
+#   get a new connection per request
+# - 'pool': psycopg's connection pool (psycopg[pool]), shared by the
+#   threads of a process, with DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE
+#   connections and DB_POOL_TIMEOUT seconds to wait for a free one
+DB_CONN_STRATEGY = config('DB_CONN_STRATEGY', default='persistent')
+
+if DB_CONN_STRATEGY == 'persistent':
+    DATABASES['default']['CONN_MAX_AGE'] = config(
+        'DB_CONN_MAX_AGE',
+        default='600',
+        cast=lambda value: None if value.lower() == 'none' else int(value)
+    )
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+elif DB_CONN_STRATEGY == 'pool':
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+        },
+    }
+elif DB_CONN_STRATEGY != 'none':
+    raise ImproperlyConfigured(f'Unknown DB_CONN_STRATEGY {DB_CONN_STRATEGY!r}')
+
+# Read replicas of the primary database, 'host' or 'host:port' each,
+# with the settings of the primary otherwise. Blog reads go to them
+# through blog.routers.ReplicaRouter; a reader stays on the primary for
+# BLOG_REPLICA_PIN_SECONDS after posting, and a replica that fails to
+# connect is skipped for BLOG_REPLICA_RETRY_SECONDS.
+BLOG_REPLICAS = []
+for number, replica_host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), 1):
+    replica_host, _, replica_port = replica_host.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': int(replica_port) if replica_port else DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    BLOG_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+BLOG_REPLICA_PIN_SECONDS = config('BLOG_REPLICA_PIN_SECONDS', default=5, cast=int)
+BLOG_REPLICA_RETRY_SECONDS = config('BLOG_REPLICA_RETRY_SECONDS', default=30, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -135,6 +199,100 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': config('CACHE_LOCATION', default='blog'),
+    },
+    # Full pages served to anonymous readers: 'locmem' or 'file'
+    'pages': {
+        'locmem': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'blog-pages',
+        },
+        'file': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config(
+                'BLOG_PAGE_CACHE_DIR',
+                default=str(BASE_DIR / 'page_cache')
+            ),
+        },
+    }[config('BLOG_PAGE_CACHE_BACKEND', default='locmem')],
+    # Rendered per-post fragments ({% cache %}), keyed by post id and
+    # update time, so they never need invalidating
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'blog-fragments',
+        'OPTIONS': {
+            'MAX_ENTRIES': config('BLOG_FRAGMENT_CACHE_ENTRIES', default=5000, cast=int),
+        },
+    },
+}
+
+# Seconds the sidebar fragments stay cached between invalidations
+BLOG_SIDEBAR_CACHE_TIMEOUT = config('BLOG_SIDEBAR_CACHE_TIMEOUT', default=300, cast=int)
+
+# Full-page cache for anonymous readers, purged on content changes
+BLOG_PAGE_CACHE_ENABLED = config('BLOG_PAGE_CACHE_ENABLED', default=True, cast=bool)
+BLOG_PAGE_CACHE_ALIAS = 'pages'
+BLOG_PAGE_CACHE_TIMEOUT = config('BLOG_PAGE_CACHE_TIMEOUT', default=600, cast=int)
+
+
+# Comments per page of the post detail page, and seconds rendered
+# comment pages stay cached between invalidations
+BLOG_COMMENTS_PER_PAGE = config('BLOG_COMMENTS_PER_PAGE', default=50, cast=int)
+BLOG_COMMENTS_CACHE_TIMEOUT = config('BLOG_COMMENTS_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Blog pagination: 'page' (numbered pages) or 'cursor' (keyset, next/previous only)
+BLOG_PAGINATION = config('BLOG_PAGINATION', default='page')
+
+# Full-text search: text search configuration and maximum number of results
+BLOG_SEARCH_CONFIG = config('BLOG_SEARCH_CONFIG', default='english')
+BLOG_SEARCH_LIMIT = config('BLOG_SEARCH_LIMIT', default=20, cast=int)
+
+# Posts per child page of the sitemap index
+BLOG_SITEMAP_LIMIT = config('BLOG_SITEMAP_LIMIT', default=5000, cast=int)
+
+# Pre-generated RSS and Atom feeds: directory of the feed files, seconds
+# post changes are collected before the feeds are rebuilt (0 rebuilds on
+# every commit) and protocol of the links in the feeds
+BLOG_FEED_ROOT = config('BLOG_FEED_ROOT', default=str(BASE_DIR / 'feeds'))
+BLOG_FEED_DEBOUNCE = config('BLOG_FEED_DEBOUNCE', default=5, cast=float)
+BLOG_FEED_PROTOCOL = config('BLOG_FEED_PROTOCOL', default='https')
+
+# Serve the list, detail, search and feed pages with the async views of
+# blog.async_views, enabled by default when running under project/asgi.py
+BLOG_ASYNC_VIEWS = config('BLOG_ASYNC_VIEWS', default=False, cast=bool)
+
+# Fraction of the requests measured by blog.middleware.MetricsMiddleware
+# (Server-Timing header and histograms at /blog/metrics/), 0 disables it
+BLOG_METRICS_SAMPLE_RATE = config('BLOG_METRICS_SAMPLE_RATE', default=0.05, cast=float)
+
+# Write-behind comments (see blog/commentqueue.py): comments are queued
+# and inserted in batches every BLOG_COMMENT_FLUSH_INTERVAL seconds, or
+# once BLOG_COMMENT_BATCH_SIZE are queued. At most BLOG_COMMENT_QUEUE_MAX
+# wait at any time, which is how many a crashed process can lose.
+BLOG_COMMENT_WRITE_BEHIND = config('BLOG_COMMENT_WRITE_BEHIND', default=False, cast=bool)
+BLOG_COMMENT_FLUSH_INTERVAL = config('BLOG_COMMENT_FLUSH_INTERVAL', default=1.0, cast=float)
+BLOG_COMMENT_BATCH_SIZE = config('BLOG_COMMENT_BATCH_SIZE', default=100, cast=int)
+BLOG_COMMENT_QUEUE_MAX = config('BLOG_COMMENT_QUEUE_MAX', default=500, cast=int)
+
+# Rate limits of the comment and share forms (see blog/ratelimit.py):
+# 'ip:N/period' per client IP, 'email:N/period' per address in the form,
+# with a period of s, m, h or d, optionally with a count, e.g. 'ip:10/5m'
+BLOG_RATELIMIT_ENABLED = config('BLOG_RATELIMIT_ENABLED', default=True, cast=bool)
+BLOG_RATELIMITS = {
+    'post_comment': config('BLOG_RATELIMIT_COMMENT', default='ip:5/m,email:20/h', cast=Csv()),
+    'post_share': config('BLOG_RATELIMIT_SHARE', default='ip:3/m,email:10/h', cast=Csv()),
+}
+
+
 # Email server configuration
 
 # Write to console
@@ -154,37 +312,38 @@ EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
 EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 
-# Logging configuration
-import os
-
-LOGGING = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'handlers': {
-        'file': {
-            'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': os.path.join(BASE_DIR, 'django_debug.log'),
-        },
-        'test_file': {
-            'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': os.path.join(BASE_DIR, 'test_output.log'),
-        },
-    },
-    'loggers': {
-        'django': {
-            'handlers': ['file'],
-            'level': 'DEBUG',
-            'propagate': True,
-        },
-        'django.test': {
-            'handlers': ['test_file'],
-            'level': 'DEBUG',
-            'propagate': True,
-        },
-    },
-}
+# Outbox worker (`send_outbox`): retries with exponential backoff starting
+# at BLOG_OUTBOX_BACKOFF seconds, dead letter after BLOG_OUTBOX_MAX_ATTEMPTS,
+# at most BLOG_OUTBOX_DOMAIN_RATE e-mails per recipient domain per minute
+BLOG_OUTBOX_MAX_ATTEMPTS = config('BLOG_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+BLOG_OUTBOX_BACKOFF = config('BLOG_OUTBOX_BACKOFF', default=60, cast=int)
+BLOG_OUTBOX_DOMAIN_RATE = config('BLOG_OUTBOX_DOMAIN_RATE', default=30, cast=int)
+# Seconds a worker holds claimed e-mails before others may retry them
+BLOG_OUTBOX_LEASE = config('BLOG_OUTBOX_LEASE', default=300, cast=int)
+
+# Logging configuration (see project/log.py): records are queued and
+# written by a background thread. 'development' writes everything,
+# SQL included, to django_debug.log; 'production' writes JSON lines at
+# LOG_LEVEL without SQL. Files rotate at LOG_MAX_BYTES, or on the
+# LOG_ROTATE_WHEN interval ('midnight', 'H', ...) when set. LOG_LEVELS
+# sets single loggers, e.g. 'django.request=ERROR,blog=DEBUG'.
+from .log import logging_config
+
+LOG_PROFILE = config('LOG_PROFILE', default='development' if DEBUG else 'production')
+
+LOGGING = logging_config(
+    LOG_PROFILE,
+    filename=config(
+        'LOG_FILE',
+        default=str(BASE_DIR / ('django_debug.log' if LOG_PROFILE == 'development' else 'logs/blog.log'))
+    ),
+    level=config('LOG_LEVEL', default='INFO'),
+    levels=config('LOG_LEVELS', default='', cast=Csv()),
+    max_bytes=config('LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int),
+    backup_count=config('LOG_BACKUP_COUNT', default=5, cast=int),
+    when=config('LOG_ROTATE_WHEN', default=''),
+    queue_size=config('LOG_QUEUE_SIZE', default=10000, cast=int),
+)
 
 # Test runner
 TEST_RUNNER = 'project.test_runner.CustomTestRunner'